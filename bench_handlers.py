@@ -0,0 +1,344 @@
+# bench_handlers.py (Per-handler latency benchmark: synthetic updates, stubbed Bot API, local Postgres)
+#
+# Usage:
+#   BENCH_DATABASE_URL=postgresql://localhost/bot_bench python bench_handlers.py            # run, compare to baseline
+#   BENCH_DATABASE_URL=postgresql://localhost/bot_bench python bench_handlers.py --save     # run and store as baseline
+#
+# Only BENCH_DATABASE_URL is used, never DATABASE_URL, so a run can not touch the production database.
+# Synthetic chats and users live in reserved id ranges and are removed before and after each run.
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import logging
+import statistics
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+# Settings read at import time by the bot modules
+os.environ.setdefault('DB_SSLMODE', 'prefer')
+# A near-zero window keeps replayed users from being blocked while still running the spam check
+os.environ.setdefault('SPAM_TIME_WINDOW', '0.000001')
+
+from psycopg2.extras import execute_values
+from telegram import Update
+from telegram.ext import Application, CallbackContext
+from telegram.request import BaseRequest
+
+import db
+import main
+import leaderboard_manager
+import message_ingest
+import partitions
+import ranking_index
+
+logger = logging.getLogger(__name__)
+
+# --- ⚙️ Benchmark Configuration ---
+BENCH_TOKEN = '123456789:BENCHMARK-STUB-TOKEN'
+BENCH_BOT_ID = 123456789
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+# Reserved id ranges for synthetic data
+BENCH_CHAT_BASE = -1009000000000
+BENCH_USER_BASE = 4000000000000000
+BENCH_CHAT_RANGE = 1000000
+BENCH_USER_RANGE = 10000000
+# Days of rollup history seeded per chat
+SEED_DAYS = 10
+SCOPES = ('daily', 'weekly', 'alltime', 'global')
+# Stubbed responses that carry a Message; everything else answers True
+MESSAGE_METHODS = {'sendMessage', 'sendPhoto', 'sendVideo', 'editMessageText', 'editMessageCaption', 'editMessageMedia'}
+PHOTO_METHODS = {'sendPhoto', 'editMessageMedia'}
+
+
+# --- 🤖 Stub Bot API ---
+class StubBotAPI(BaseRequest):
+    """
+    Request backend for the real Bot object: every API call is answered locally with a
+    minimal valid result, so handlers run their full serialisation path without the network.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self._ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({'ok': True, 'result': self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint, params):
+        if endpoint == 'getMe':
+            return {'id': BENCH_BOT_ID, 'is_bot': True, 'first_name': 'Bench Bot', 'username': 'bench_bot'}
+        if endpoint not in MESSAGE_METHODS:
+            return True
+        message_id = next(self._ids)
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', BENCH_CHAT_BASE)), 'type': 'supergroup'},
+        }
+        if endpoint in PHOTO_METHODS:
+            message['photo'] = [{'file_id': f'bench-photo-{message_id}', 'file_unique_id': f'u{message_id}', 'width': 800, 'height': 600}]
+        return message
+
+
+# --- 🧪 Synthetic Data ---
+def bench_chat_id(i: int) -> int:
+    return BENCH_CHAT_BASE - i
+
+def bench_user_id(i: int) -> int:
+    return BENCH_USER_BASE + i
+
+def _cleanup(conn):
+    chat_low, chat_high = BENCH_CHAT_BASE - BENCH_CHAT_RANGE, BENCH_CHAT_BASE
+    with conn.cursor() as cur:
+        for table in ('messages', 'message_counts_daily', 'user_chat_totals', 'chats'):
+            cur.execute(f"DELETE FROM {table} WHERE chat_id BETWEEN %s AND %s;", (chat_low, chat_high))
+        cur.execute("DELETE FROM users WHERE user_id BETWEEN %s AND %s;", (BENCH_USER_BASE, BENCH_USER_BASE + BENCH_USER_RANGE))
+
+def _seed(conn, chats: int, users: int, users_per_chat: int, rng: random.Random):
+    today = datetime.now(timezone.utc).date()
+    chat_rows = [(bench_chat_id(i), f"Bench Chat {i}", 'supergroup') for i in range(chats)]
+    user_rows = [(bench_user_id(i), f"Bench User {i}") for i in range(users)]
+    daily_rows = []
+    totals = Counter()
+    for i in range(chats):
+        members = rng.sample(range(users), min(users_per_chat, users))
+        for u in members:
+            for d in range(SEED_DAYS):
+                if rng.random() < 0.6:
+                    count = rng.randint(1, 200)
+                    daily_rows.append((bench_chat_id(i), bench_user_id(u), today - timedelta(days=d), count))
+                    totals[(bench_user_id(u), bench_chat_id(i))] += count
+    with conn.cursor() as cur:
+        execute_values(cur, "INSERT INTO chats (chat_id, chat_name, chat_type) VALUES %s;", chat_rows)
+        execute_values(cur, "INSERT INTO users (user_id, display_name) VALUES %s ON CONFLICT (user_id) DO NOTHING;", user_rows)
+        execute_values(cur, "INSERT INTO message_counts_daily (chat_id, user_id, day, message_count) VALUES %s;", daily_rows, page_size=5000)
+        execute_values(
+            cur, "INSERT INTO user_chat_totals (user_id, chat_id, message_count) VALUES %s;",
+            [(user_id, chat_id, count) for (user_id, chat_id), count in totals.items()], page_size=5000
+        )
+    return len(daily_rows)
+
+
+class UpdateFactory:
+    """Builds Update objects from Bot API JSON, bound to the stub bot like real webhook updates."""
+
+    def __init__(self, bot, chats: int, users: int, rng: random.Random):
+        self.bot = bot
+        self.chats = chats
+        self.users = users
+        self.rng = rng
+        self._ids = itertools.count(1)
+
+    def _chat(self):
+        i = self.rng.randrange(self.chats)
+        return {'id': bench_chat_id(i), 'type': 'supergroup', 'title': f"Bench Chat {i}"}
+
+    def _user(self):
+        i = self.rng.randrange(self.users)
+        return {'id': bench_user_id(i), 'is_bot': False, 'first_name': 'Bench', 'last_name': f"User {i}"}
+
+    def _message(self, **fields):
+        message = {'message_id': next(self._ids), 'date': int(time.time()), 'chat': self._chat(), 'from': self._user()}
+        message.update(fields)
+        return message
+
+    def _update(self, **fields):
+        return Update.de_json({'update_id': next(self._ids), **fields}, self.bot)
+
+    def group_message(self):
+        return self._update(message=self._message(text=self.rng.choice(('hi', 'hello everyone', 'gm', 'lol 😂'))))
+
+    def ranking_command(self):
+        return self._update(message=self._message(
+            text='/ranking', entities=[{'type': 'bot_command', 'offset': 0, 'length': 8}]
+        ))
+
+    def leaderboard_callback(self):
+        message = self._message(photo=[{'file_id': 'bench-photo-0', 'file_unique_id': 'u0', 'width': 800, 'height': 600}])
+        message['from'] = {'id': BENCH_BOT_ID, 'is_bot': True, 'first_name': 'Bench Bot'}
+        return self._update(callback_query={
+            'id': str(next(self._ids)),
+            'from': self._user(),
+            'chat_instance': 'bench',
+            'message': message,
+            'data': f"lb_{self.rng.choice(SCOPES)}:{message['chat']['id']}",
+        })
+
+    def new_member(self):
+        return self._update(message=self._message(new_chat_members=[self._user()]))
+
+
+# name -> (handler, UpdateFactory method)
+SCENARIOS = {
+    'handle_all_messages': (main.handle_all_messages, UpdateFactory.group_message),
+    'ranking_command': (leaderboard_manager.ranking_command, UpdateFactory.ranking_command),
+    'leaderboard_callback': (leaderboard_manager.leaderboard_callback, UpdateFactory.leaderboard_callback),
+    'welcome_new_member': (main.welcome_new_member, UpdateFactory.new_member),
+}
+
+
+# --- ⏱️ Measurement ---
+def summarize(samples: list, elapsed: float) -> dict:
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {
+        'n': len(samples),
+        'throughput': len(samples) / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.fmean(samples),
+        'p50_ms': cuts[49],
+        'p95_ms': cuts[94],
+        'p99_ms': cuts[98],
+        'max_ms': max(samples),
+    }
+
+async def run_scenario(application, factory, api, name, iterations, warmup) -> dict:
+    handler, make_update = SCENARIOS[name]
+    # Updates are built up front so only handler time is measured
+    updates = [make_update(factory) for _ in range(warmup + iterations)]
+    for update in updates[:warmup]:
+        await handler(update, CallbackContext.from_update(update, application))
+    api.calls.clear()
+    samples = []
+    started = time.perf_counter()
+    for update in updates[warmup:]:
+        context = CallbackContext.from_update(update, application)
+        t0 = time.perf_counter()
+        await handler(update, context)
+        samples.append((time.perf_counter() - t0) * 1000)
+    result = summarize(samples, time.perf_counter() - started)
+    result['api_calls_per_update'] = sum(api.calls.values()) / iterations
+    return result
+
+
+# --- 📊 Reporting ---
+def print_report(results: dict, baseline: dict = None, threshold: float = 0.0) -> list:
+    """Prints one row per handler; returns the handlers whose p95 regressed past `threshold`."""
+    regressions = []
+    header = f"{'handler':<22} {'n':>6} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'api/upd':>8}"
+    if baseline:
+        header += f" {'p95 vs base':>12}"
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        line = (
+            f"{name:<22} {r['n']:>6} {r['throughput']:>9.1f} {r['p50_ms']:>8.2f} "
+            f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['api_calls_per_update']:>8.2f}"
+        )
+        base = (baseline or {}).get(name)
+        if base:
+            change = (r['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0
+            line += f" {change:>+11.1%}"
+            if change > threshold:
+                regressions.append(name)
+                line += '  ⚠️'
+        print(line)
+    return regressions
+
+def load_baseline(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read baseline {path}: {e}")
+        return None
+
+def save_baseline(path: str, results: dict, config: dict):
+    with open(path, 'w') as f:
+        json.dump({'created_at': datetime.now(timezone.utc).isoformat(), 'config': config, 'results': results}, f, indent=2)
+    print(f"Baseline saved to {path}")
+
+
+# --- 🚀 Runner ---
+async def run(args) -> int:
+    dsn = os.environ.get('BENCH_DATABASE_URL')
+    if not dsn:
+        print("BENCH_DATABASE_URL is not set. Point it at a local, disposable Postgres database.", file=sys.stderr)
+        return 2
+    os.environ['DATABASE_URL'] = dsn
+    rng = random.Random(args.seed)
+
+    api = StubBotAPI(args.api_latency_ms)
+    application = Application.builder().token(BENCH_TOKEN).request(api).get_updates_request(StubBotAPI()).build()
+    await application.initialize()
+    if not await db.pool.open():
+        await application.shutdown()
+        return 2
+    db.pool.mark_startup_done()
+    try:
+        await leaderboard_manager.setup_database()
+        await partitions.manager.ensure_upcoming()
+        await db.pool.run(_cleanup)
+        seeded = await db.pool.run(_seed, args.chats, args.users, args.users_per_chat, rng)
+        print(f"Seeded {args.chats} chats, {args.users} users, {seeded} daily rollup rows.")
+
+        leaderboard_manager.render_pool.start()
+        await asyncio.to_thread(leaderboard_manager.render_assets.warm)
+        message_ingest.ingestor.start()
+        await ranking_index.index.rebuild()
+
+        factory = UpdateFactory(application.bot, args.chats, args.users, rng)
+        results = {}
+        for name in args.handlers:
+            results[name] = await run_scenario(application, factory, api, name, args.iterations, args.warmup)
+
+        config = {key: getattr(args, key) for key in ('iterations', 'warmup', 'chats', 'users', 'users_per_chat', 'api_latency_ms', 'seed')}
+        baseline = None if args.save else load_baseline(args.baseline)
+        if baseline and baseline.get('config') != config:
+            print("Note: baseline was recorded with a different configuration.")
+        regressions = print_report(results, (baseline or {}).get('results'), args.threshold)
+        if args.save:
+            save_baseline(args.baseline, results, config)
+        elif regressions:
+            print(f"p95 regressed by more than {args.threshold:.0%} for: {', '.join(regressions)}")
+            return 1
+        return 0
+    finally:
+        await message_ingest.ingestor.stop()
+        try:
+            await db.pool.run(_cleanup)
+        except Exception as e:
+            logger.warning(f"Cleanup of benchmark rows failed: {e}")
+        await db.pool.close()
+        leaderboard_manager.render_pool.shutdown()
+        await application.shutdown()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay synthetic updates through the bot's handlers and report latency.")
+    parser.add_argument('--handlers', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--iterations', type=int, default=500, help="measured updates per handler")
+    parser.add_argument('--warmup', type=int, default=50, help="unmeasured updates per handler")
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--users-per-chat', type=int, default=200)
+    parser.add_argument('--api-latency-ms', type=float, default=0.0, help="simulated Bot API round trip")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed p95 increase over the baseline")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    # Handler logging at INFO would dominate the measurements
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.exit(asyncio.run(run(arguments)))
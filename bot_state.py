@@ -0,0 +1,76 @@
+# bot_state.py (bot_data keys that must survive restarts, persisted per key in Postgres)
+
+import asyncio
+import logging
+
+from psycopg2.extras import Json
+
+import db
+
+logger = logging.getLogger(__name__)
+
+
+# --- DB Helpers ---
+def _load_all(conn, keys):
+    with conn.cursor() as cur:
+        cur.execute("SELECT key, value FROM bot_state WHERE key = ANY(%s);", (list(keys),))
+        return cur.fetchall()
+
+def _upsert(conn, key, value):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO bot_state (key, value, updated_at)
+            VALUES (%s, %s, NOW())
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW();
+        """, (key, Json(value)))
+
+
+class BotStateStore:
+    """
+    Mirrors a fixed set of bot_data keys into the bot_state table. Values must be
+    JSON-serialisable. Writes are one upsert per changed key, never the whole dict.
+    """
+
+    def __init__(self):
+        self.keys = set()
+        # Set once persisted values are in bot_data (or loading gave up), so callers
+        # can hold back decisions that depend on them, like the quiz cooldown
+        self.ready = asyncio.Event()
+        self.loaded = 0
+        self.writes = 0
+        self.write_errors = 0
+
+    def track(self, *keys):
+        self.keys.update(keys)
+
+    async def load(self, bot_data: dict):
+        try:
+            if db.pool.is_open and self.keys:
+                rows = await db.pool.run(_load_all, self.keys)
+                for key, value in rows:
+                    # Anything set since startup is newer than the stored copy
+                    bot_data.setdefault(key, value)
+                self.loaded = len(rows)
+                logger.info(f"Restored {self.loaded} persisted bot_data keys.")
+        except Exception as e:
+            logger.error(f"Failed to load persisted bot state: {e}")
+        finally:
+            self.ready.set()
+
+    async def set(self, bot_data: dict, key: str, value):
+        """Sets bot_data[key] and persists it. A failed write is logged; memory stays authoritative."""
+        bot_data[key] = value
+        if key not in self.keys or not db.pool.is_open:
+            return
+        try:
+            await db.pool.run(_upsert, key, value)
+            self.writes += 1
+        except Exception as e:
+            self.write_errors += 1
+            logger.error(f"Failed to persist bot state key {key}: {e}")
+
+    def stats(self) -> dict:
+        return {'ready': self.ready.is_set(), 'loaded': self.loaded, 'writes': self.writes, 'write_errors': self.write_errors}
+
+
+store = BotStateStore()
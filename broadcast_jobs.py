@@ -0,0 +1,318 @@
+# broadcast_jobs.py (Persistent, checkpointed owner broadcasts that survive restarts)
+
+import os
+import asyncio
+import logging
+import time
+
+import telegram.error
+from telegram import Update, constants
+from telegram.ext import ContextTypes
+
+import db
+import outbound
+import leaderboard_manager
+
+logger = logging.getLogger(__name__)
+
+OWNER_ID = os.environ.get('OWNER_ID')
+if not OWNER_ID:
+    logger.warning("OWNER_ID environment variable is not set. Broadcast command will be disabled.")
+
+# --- ⚙️ Broadcast Job Configuration ---
+# Targets sent between checkpoints; after a crash at most one batch is sent again
+BROADCAST_BATCH_SIZE = int(os.environ.get('BROADCAST_BATCH_SIZE', '50'))
+# Backoff (seconds) before an interrupted job is retried from its checkpoint, doubling up to the max
+BROADCAST_RETRY_DELAY = float(os.environ.get('BROADCAST_RETRY_DELAY', '30'))
+BROADCAST_RETRY_MAX_DELAY = float(os.environ.get('BROADCAST_RETRY_MAX_DELAY', '600'))
+# Attempts (first run included) before a job that keeps failing is marked failed and left alone
+BROADCAST_MAX_ATTEMPTS = int(os.environ.get('BROADCAST_MAX_ATTEMPTS', '6'))
+
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+
+# --- DB Helpers ---
+def _create_job(conn, from_chat_id, message_id):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO broadcast_jobs (from_chat_id, message_id, status)
+            VALUES (%s, %s, %s)
+            RETURNING id;
+        """, (from_chat_id, message_id, STATUS_RUNNING))
+        job_id = cur.fetchone()[0]
+        # Snapshot the audience now, so later joins/leaves do not shift a resumed job
+        cur.execute("""
+            INSERT INTO broadcast_targets (job_id, seq, chat_id)
+            SELECT %s, ROW_NUMBER() OVER (ORDER BY chat_id), chat_id
+            FROM chats
+            WHERE is_active = TRUE;
+        """, (job_id,))
+        total = cur.rowcount
+        cur.execute("UPDATE broadcast_jobs SET total = %s WHERE id = %s;", (total, job_id))
+    return job_id, total
+
+def _load_job(conn, job_id):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT from_chat_id, message_id, status, total, position, succeeded, failed, deactivated
+            FROM broadcast_jobs WHERE id = %s;
+        """, (job_id,))
+        return cur.fetchone()
+
+def _next_batch(conn, job_id, position, limit):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT seq, chat_id FROM broadcast_targets
+            WHERE job_id = %s AND seq > %s
+            ORDER BY seq
+            LIMIT %s;
+        """, (job_id, position, limit))
+        return cur.fetchall()
+
+def _checkpoint(conn, job_id, position, succeeded, failed, deactivated, finished):
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE broadcast_jobs
+            SET position = %s, succeeded = succeeded + %s, failed = failed + %s,
+                deactivated = deactivated + %s, status = %s, updated_at = NOW(),
+                finished_at = CASE WHEN %s THEN NOW() ELSE finished_at END
+            WHERE id = %s;
+        """, (position, succeeded, failed, deactivated,
+              STATUS_COMPLETED if finished else STATUS_RUNNING, finished, job_id))
+
+def _mark_failed(conn, job_id):
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE broadcast_jobs SET status = %s, updated_at = NOW(), finished_at = NOW()
+            WHERE id = %s AND status = %s;
+        """, (STATUS_FAILED, job_id, STATUS_RUNNING))
+
+def _running_job_ids(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM broadcast_jobs WHERE status = %s ORDER BY id;", (STATUS_RUNNING,))
+        return [row[0] for row in cur.fetchall()]
+
+def _recent_jobs(conn, limit):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, status, total, position, succeeded, failed, deactivated, created_at
+            FROM broadcast_jobs ORDER BY id DESC LIMIT %s;
+        """, (limit,))
+        return cur.fetchall()
+
+
+# --- Sending ---
+async def send_broadcast_and_handle_errors(bot, chat_id, from_chat_id, message_id, deactivator):
+    try:
+        await outbound.dispatcher.call(
+            chat_id,
+            bot.copy_message,
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_id=message_id
+        )
+        return (chat_id, "Success")
+    except (telegram.error.Forbidden, telegram.error.BadRequest) as e:
+        logger.warning(f"Broadcast failed for {chat_id} (Forbidden/Bad Request). Deactivating: {e}")
+        await deactivator.add(chat_id)
+        return (chat_id, "Failed_Deactivated")
+    except Exception as e:
+        logger.error(f"Broadcast failed for {chat_id} (Other): {e}")
+        return (chat_id, "Failed_Error")
+
+
+class BroadcastRunner:
+    """Runs persisted broadcast jobs in background tasks and tracks their live send rate."""
+
+    def __init__(self):
+        self._tasks = {}
+        # job_id -> (started monotonic, chats sent since this process picked the job up)
+        self._live = {}
+        # job_id -> (targets checkpointed, total targets), for /metrics
+        self._positions = {}
+
+    def start(self, bot, job_id: int):
+        if job_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(bot, job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def resume_all(self, bot):
+        """Picks up every job a previous process left in the running state."""
+        if not db.pool.is_open:
+            return
+        try:
+            job_ids = await db.pool.run(_running_job_ids)
+        except Exception as e:
+            logger.error(f"Failed to load unfinished broadcast jobs: {e}")
+            return
+        for job_id in job_ids:
+            logger.info(f"Resuming broadcast job {job_id}.")
+            self.start(bot, job_id)
+
+    async def _run(self, bot, job_id: int):
+        attempt = 0
+        while True:
+            try:
+                summary = await self._send_all(bot, job_id)
+                break
+            except Exception as e:
+                attempt += 1
+                if attempt >= BROADCAST_MAX_ATTEMPTS:
+                    logger.error(f"Broadcast job {job_id} failed {attempt} times, giving up: {e}")
+                    await self._give_up(job_id)
+                    return
+                # The job stays 'running' with its last checkpoint; retry here instead of waiting for a restart
+                delay = min(BROADCAST_RETRY_DELAY * 2 ** (attempt - 1), BROADCAST_RETRY_MAX_DELAY)
+                logger.error(f"Broadcast job {job_id} interrupted: {e}. Retrying from its checkpoint in {delay:.0f}s.")
+                await asyncio.sleep(delay)
+            finally:
+                self._live.pop(job_id, None)
+                self._positions.pop(job_id, None)
+
+        if summary is None:
+            return
+        from_chat_id, total, succeeded, failed, deactivated = summary
+        try:
+            await bot.send_message(
+                chat_id=from_chat_id,
+                text=(
+                    f"✅ Broadcast #{job_id} complete! Successfully sent to {succeeded} / {total} chats "
+                    f"({failed} failed, {deactivated} chats deactivated)."
+                )
+            )
+        except Exception as e:
+            # The job is already checkpointed as completed; only the owner's notice was lost
+            logger.warning(f"Broadcast job {job_id} completed, but the completion notice failed: {e}")
+
+    async def _give_up(self, job_id: int):
+        try:
+            await db.pool.run(_mark_failed, job_id)
+        except Exception as e:
+            # Still 'running' in the DB, so the next process picks it up again
+            logger.error(f"Failed to mark broadcast job {job_id} as failed: {e}")
+
+    async def _send_all(self, bot, job_id: int):
+        """
+        Sends the job from its last checkpoint to the end. Returns (from_chat_id, total, succeeded,
+        failed, deactivated), or None if the job is gone or no longer running.
+        """
+        row = await db.pool.run(_load_job, job_id)
+        if row is None or row[2] != STATUS_RUNNING:
+            logger.info(f"Broadcast job {job_id} is no longer running; nothing to do.")
+            return None
+        from_chat_id, message_id, status, total, position, succeeded, failed, deactivated = row
+        self._live[job_id] = (time.monotonic(), 0)
+        self._positions[job_id] = (position, total)
+        deactivator = leaderboard_manager.ChatDeactivator()
+        while True:
+            batch = await db.pool.run(_next_batch, job_id, position, BROADCAST_BATCH_SIZE)
+            if not batch:
+                await db.pool.run(_checkpoint, job_id, position, 0, 0, 0, True)
+                return from_chat_id, total, succeeded, failed, deactivated
+            results = await outbound.dispatcher.run_bulk(
+                f'broadcast_{job_id}',
+                [chat_id for _, chat_id in batch],
+                lambda chat_id: send_broadcast_and_handle_errors(bot, chat_id, from_chat_id, message_id, deactivator),
+                is_success=lambda res: isinstance(res, tuple) and res[1] == "Success"
+            )
+            # Rejecting chats are deactivated with one UPDATE per batch, before the checkpoint moves past them
+            batch_deactivated = await deactivator.flush()
+            batch_ok = sum(1 for res in results if isinstance(res, tuple) and res[1] == "Success")
+            position = batch[-1][0]
+            succeeded += batch_ok
+            failed += len(results) - batch_ok
+            deactivated += batch_deactivated
+            await db.pool.run(
+                _checkpoint, job_id, position, batch_ok, len(results) - batch_ok, batch_deactivated, False
+            )
+            started, sent = self._live[job_id]
+            self._live[job_id] = (started, sent + len(results))
+            self._positions[job_id] = (position, total)
+
+    def progress(self) -> list:
+        """Running jobs as (job_id, position, total, live rate)."""
+        return [
+            (job_id, position, total, self.live_rate(job_id) or 0.0)
+            for job_id, (position, total) in list(self._positions.items())
+        ]
+
+    def live_rate(self, job_id: int):
+        live = self._live.get(job_id)
+        if not live:
+            return None
+        started, sent = live
+        elapsed = time.monotonic() - started
+        return sent / elapsed if elapsed > 0 else 0.0
+
+
+runner = BroadcastRunner()
+
+
+def _is_owner_private(update: Update) -> bool:
+    return bool(OWNER_ID) and str(update.effective_user.id) == str(OWNER_ID) and \
+        update.effective_chat.type == constants.ChatType.PRIVATE
+
+# --- Broadcast Commands ---
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not OWNER_ID:
+        await update.message.reply_text("Bot owner ID is not configured. Broadcast disabled.")
+        logger.error("Broadcast command used but OWNER_ID is not set.")
+        return
+    if str(update.effective_user.id) != str(OWNER_ID):
+        await update.message.reply_text("This is an owner-only command.")
+        return
+    if update.effective_chat.type not in [constants.ChatType.PRIVATE]:
+        await update.message.reply_text("This command must be used in a private chat.")
+        return
+    if not update.message.reply_to_message:
+        await update.message.reply_text("Please reply to the message you want to broadcast.")
+        return
+    if not db.pool.is_open:
+        await update.message.reply_text("Database is offline. Broadcast unavailable.")
+        return
+
+    broadcast_message = update.message.reply_to_message
+    try:
+        job_id, total = await db.pool.run(_create_job, update.effective_chat.id, broadcast_message.message_id)
+        if not total:
+            await db.pool.run(_checkpoint, job_id, 0, 0, 0, 0, True)
+    except Exception as e:
+        logger.error(f"Failed to create broadcast job: {e}")
+        await update.message.reply_text("Could not create the broadcast job.")
+        return
+    if not total:
+        await update.message.reply_text("No active chats found to broadcast to.")
+        return
+
+    await update.message.reply_text(
+        f"Starting broadcast #{job_id}... Sending to {total} chats. Use /broadcast_status to follow it."
+    )
+    runner.start(context.bot, job_id)
+
+async def broadcast_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not _is_owner_private(update):
+        await update.message.reply_text("This is an owner-only command.")
+        return
+    if not db.pool.is_open:
+        await update.message.reply_text("Database is offline.")
+        return
+
+    jobs = await db.pool.run(_recent_jobs, 5)
+    if not jobs:
+        await update.message.reply_text("No broadcasts yet.")
+        return
+
+    lines = ["📣 Recent broadcasts:"]
+    for job_id, status, total, position, succeeded, failed, deactivated, created_at in jobs:
+        line = f"#{job_id} [{status}] {position}/{total} sent, {succeeded} ok, {failed} failed, {deactivated} deactivated"
+        rate = runner.live_rate(job_id)
+        if rate is not None:
+            remaining = total - position
+            eta = f", ETA {remaining / rate / 60:.1f} min" if rate > 0 else ""
+            line += f", {rate:.1f} chats/s{eta}"
+        lines.append(line)
+    await update.message.reply_text("\n".join(lines))
@@ -0,0 +1,106 @@
+# chat_cache.py (TTL-bounded LRU of chat metadata to debounce chats upserts)
+
+import os
+import time
+from collections import OrderedDict
+
+# --- ⚙️ Cache Configuration ---
+CHAT_CACHE_SIZE = int(os.environ.get('CHAT_CACHE_SIZE', '10000'))
+CHAT_CACHE_TTL = int(os.environ.get('CHAT_CACHE_TTL', '3600'))
+# Only re-persist last_activity when the stored value is older than this (seconds)
+CHAT_ACTIVITY_PERSIST_INTERVAL = int(os.environ.get('CHAT_ACTIVITY_PERSIST_INTERVAL', '300'))
+
+
+class ChatEntry:
+    __slots__ = ('name', 'chat_type', 'is_active', 'persisted_activity', 'cached_at')
+
+    def __init__(self, name, chat_type, is_active, persisted_activity, cached_at):
+        self.name = name
+        self.chat_type = chat_type
+        self.is_active = is_active
+        self.persisted_activity = persisted_activity
+        self.cached_at = cached_at
+
+
+class ChatMetadataCache:
+    def __init__(self, max_size: int, ttl: int, persist_interval: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist_interval = persist_interval
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.writes_skipped = 0
+
+    def _get(self, chat_id, now):
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return None
+        if now - entry.cached_at > self.ttl:
+            del self._entries[chat_id]
+            return None
+        self._entries.move_to_end(chat_id)
+        return entry
+
+    def _put(self, chat_id, entry):
+        self._entries[chat_id] = entry
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def claim_write(self, chat_id, name, chat_type) -> bool:
+        """
+        Returns True if the caller should persist this chat now, and optimistically
+        records it as persisted so concurrent updates for the same chat skip the write.
+        """
+        now = time.monotonic()
+        entry = self._get(chat_id, now)
+        if (entry is not None and entry.is_active and entry.name == name and entry.chat_type == chat_type
+                and entry.persisted_activity is not None
+                and now - entry.persisted_activity < self.persist_interval):
+            self.writes_skipped += 1
+            return False
+        self.writes += 1
+        self._put(chat_id, ChatEntry(name, chat_type, True, now, now))
+        return True
+
+    def invalidate(self, chat_id):
+        self._entries.pop(chat_id, None)
+
+    def store(self, chat_id, name, chat_type=None, is_active=True):
+        """Caches metadata read from the DB without counting it as a persisted activity."""
+        now = time.monotonic()
+        entry = self._get(chat_id, now)
+        if entry is not None:
+            entry.name = name
+            entry.chat_type = chat_type or entry.chat_type
+            entry.is_active = is_active
+            return
+        self._put(chat_id, ChatEntry(name, chat_type, is_active, None, now))
+
+    def get_name(self, chat_id):
+        entry = self._get(chat_id, time.monotonic())
+        if entry is None or entry.name is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.name
+
+    def mark_inactive(self, chat_ids):
+        for chat_id in chat_ids:
+            entry = self._entries.get(chat_id)
+            if entry is not None:
+                entry.is_active = False
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'writes_skipped': self.writes_skipped,
+        }
+
+
+cache = ChatMetadataCache(CHAT_CACHE_SIZE, CHAT_CACHE_TTL, CHAT_ACTIVITY_PERSIST_INTERVAL)
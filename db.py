@@ -0,0 +1,244 @@
+# db.py (Shared async Postgres pool used by every handler)
+
+import os
+import re
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- ⚙️ Pool Configuration ---
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+# Seconds a handler may wait for a free connection before giving up
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+# Seconds a user-facing handler waits for the background warm-up to open the pool
+DB_STARTUP_WAIT = float(os.environ.get('DB_STARTUP_WAIT', '15'))
+# Managed Postgres needs TLS; a local database (e.g. for bench_handlers.py) may set 'prefer' or 'disable'
+DB_SSLMODE = os.environ.get('DB_SSLMODE', 'require')
+
+
+class DatabaseUnavailable(Exception):
+    """Raised when the pool is not open (no DATABASE_URL or startup connect failed)."""
+
+
+class AsyncConnectionPool:
+    """
+    Long-lived, bounded pool of TLS connections.
+    psycopg2 is blocking, so every unit of work runs on a dedicated worker thread
+    (one per connection) and the event loop only awaits the result.
+    """
+
+    def __init__(self, min_size: int, max_size: int, acquire_timeout: float):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self._pool = None
+        self._executor = None
+        self._semaphore = None
+        # Set by whoever drives startup once the pool is open and migrated (or failed to open)
+        self._startup_done = asyncio.Event()
+        # Stats
+        self._in_use = 0
+        self._waiting = 0
+        self._acquired = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._pool is not None
+
+    def mark_startup_done(self):
+        self._startup_done.set()
+
+    async def wait_ready(self, timeout: float = DB_STARTUP_WAIT) -> bool:
+        """Waits for startup to finish, up to `timeout` seconds. Returns whether the pool is open."""
+        if not self._startup_done.is_set():
+            try:
+                await asyncio.wait_for(self._startup_done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.is_open
+
+    async def open(self) -> bool:
+        if self._pool:
+            return True
+        dsn = os.environ.get('DATABASE_URL')
+        if not dsn:
+            logger.error("DATABASE_URL environment variable is not set.")
+            return False
+
+        executor = ThreadPoolExecutor(max_workers=self.max_size, thread_name_prefix='db')
+        loop = asyncio.get_running_loop()
+        try:
+            self._pool = await loop.run_in_executor(
+                executor,
+                lambda: pg_pool.ThreadedConnectionPool(
+                    self.min_size, self.max_size, dsn,
+                    sslmode=DB_SSLMODE, keepalives=1, keepalives_idle=30
+                )
+            )
+        except Exception as e:
+            logger.error(f"Database connection failed: {e}")
+            executor.shutdown(wait=False)
+            return False
+
+        self._executor = executor
+        self._semaphore = asyncio.Semaphore(self.max_size)
+        logger.info(f"Database pool opened (min={self.min_size}, max={self.max_size}).")
+        return True
+
+    async def close(self):
+        if not self._pool:
+            return
+        db_pool, executor = self._pool, self._executor
+        # New calls fail fast from here on; calls already on a worker finish before connections close
+        self._pool = None
+        self._executor = None
+        await asyncio.to_thread(executor.shutdown, wait=True)
+        await asyncio.to_thread(db_pool.closeall)
+        logger.info("Database pool closed.")
+
+    async def run(self, fn, *args):
+        """Runs fn(conn, *args) on a pooled connection, commits, and returns its result."""
+        if not self._pool:
+            raise DatabaseUnavailable("Database pool is not open.")
+
+        wait_start = time.perf_counter()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise DatabaseUnavailable(f"Timed out after {self.acquire_timeout}s waiting for a DB connection.")
+        finally:
+            self._waiting -= 1
+
+        waited = time.perf_counter() - wait_start
+        self._acquired += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+        db_pool, executor = self._pool, self._executor
+        if db_pool is None:
+            self._semaphore.release()
+            raise DatabaseUnavailable("Database pool closed while waiting for a connection.")
+
+        label = _sql_label(args[0]) if fn in _SQL_HELPERS else getattr(fn, '__name__', 'query')
+        loop = asyncio.get_running_loop()
+        self._in_use += 1
+        try:
+            worker = executor.submit(self._run_sync, db_pool, fn, args)
+        except BaseException:
+            # e.g. the executor was shut down by close(); the slot must not leak
+            self._release()
+            raise
+        # Release on completion of the worker, not of the awaiting coroutine,
+        # so a cancelled handler can never push more work than there are connections.
+        worker.add_done_callback(functools.partial(self._on_worker_done, loop))
+        started = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(worker)
+        except Exception:
+            metrics.db_query_errors.inc(label)
+            raise
+        finally:
+            metrics.db_query_seconds.observe(time.perf_counter() - started, label)
+
+    def _on_worker_done(self, loop, _worker):
+        # Runs on the worker thread
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            pass  # Event loop already closed at shutdown
+
+    def _release(self):
+        self._in_use -= 1
+        self._semaphore.release()
+
+    def _run_sync(self, db_pool, fn, args):
+        # One retry covers connections the server dropped while they sat idle in the pool.
+        for attempt in (1, 2):
+            conn = db_pool.getconn()
+            broken = False
+            try:
+                result = fn(conn, *args)
+                conn.commit()
+                return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = bool(conn.closed)
+                if not broken:
+                    conn.rollback()
+                if not broken or attempt == 2:
+                    raise
+                logger.warning("Discarding broken pooled DB connection and retrying.")
+            except Exception:
+                broken = bool(conn.closed)
+                if not broken:
+                    conn.rollback()
+                raise
+            finally:
+                db_pool.putconn(conn, close=broken)
+
+    def stats(self) -> dict:
+        idle = len(self._pool._pool) if self._pool else 0
+        return {
+            'open': self.is_open,
+            'max_size': self.max_size,
+            'in_use': self._in_use,
+            'idle': idle,
+            'waiting': self._waiting,
+            'acquired': self._acquired,
+            'timeouts': self._timeouts,
+            'wait_avg_ms': (self._wait_total / self._acquired * 1000) if self._acquired else 0.0,
+            'wait_max_ms': self._wait_max * 1000,
+        }
+
+
+pool = AsyncConnectionPool(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_ACQUIRE_TIMEOUT)
+
+
+# --- Query Helpers ---
+def _fetchall(conn, sql, params):
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+def _fetchone(conn, sql, params):
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchone()
+
+def _execute(conn, sql, params):
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.rowcount
+
+_SQL_HELPERS = (_fetchall, _fetchone, _execute)
+_SQL_TARGET = re.compile(r'\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|FROM)\s+(\w+)', re.IGNORECASE)
+
+@functools.lru_cache(maxsize=256)
+def _sql_label(sql: str) -> str:
+    """Metrics label for an ad-hoc statement, e.g. 'insert_chats'. Statements are literals, so this is cached."""
+    verb = sql.split(None, 1)[0].lower() if sql.strip() else 'query'
+    match = _SQL_TARGET.search(sql)
+    return f"{verb}_{match.group(1).lower()}" if match else verb
+
+async def fetchall(sql: str, params=None) -> list:
+    return await pool.run(_fetchall, sql, params)
+
+async def fetchone(sql: str, params=None):
+    return await pool.run(_fetchone, sql, params)
+
+async def execute(sql: str, params=None) -> int:
+    return await pool.run(_execute, sql, params)
@@ -0,0 +1,80 @@
+# http_client.py (One pooled async HTTP client for Pexels, Stable Horde and Open Trivia DB)
+
+import os
+import asyncio
+import logging
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# --- ⚙️ HTTP Configuration ---
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', '10'))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', '20'))
+HTTP_MAX_KEEPALIVE = int(os.environ.get('HTTP_MAX_KEEPALIVE', '10'))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('HTTP_KEEPALIVE_EXPIRY', '30'))
+# Requests in flight per remote host; more wait their turn
+HTTP_PER_HOST_LIMIT = int(os.environ.get('HTTP_PER_HOST_LIMIT', '4'))
+
+
+class SharedHttpClient:
+    def __init__(self):
+        self._client = None
+        self._host_limits = {}
+        self.requests = 0
+        self.errors = 0
+
+    async def start(self):
+        if self._client:
+            return
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            headers={"User-Agent": "TelegramBot/1.0"},
+        )
+        logger.info("Shared HTTP client started.")
+
+    async def close(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).hostname or ''
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(HTTP_PER_HOST_LIMIT)
+        return limit
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends a request through the shared pool. Raises httpx.HTTPError subclasses like the client does.
+        Callers should not pass timeout=: httpx would replace the whole configured Timeout, connect included.
+        """
+        if not self._client:
+            await self.start()
+        async with self._host_limit(url):
+            self.requests += 1
+            try:
+                return await self._client.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                self.errors += 1
+                raise
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        return {'requests': self.requests, 'errors': self.errors}
+
+
+client = SharedHttpClient()
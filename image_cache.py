@@ -0,0 +1,84 @@
+# image_cache.py (Content-addressed cache of rendered leaderboard images)
+
+import os
+import hashlib
+from collections import OrderedDict
+
+# --- ⚙️ Cache Configuration ---
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get('IMAGE_CACHE_MAX_ENTRIES', '512'))
+
+
+def make_key(title: str, chat_name: str, leaderboard_data: list, total_count: int) -> str:
+    """Hash of everything that ends up in the picture; identical rankings share one entry."""
+    payload = repr((title, chat_name, [tuple(row) for row in leaderboard_data], total_count))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CachedImage:
+    __slots__ = ('png', 'file_id')
+
+    def __init__(self, png: bytes, file_id: str = None):
+        self.png = png
+        self.file_id = file_id
+
+
+class ImageCache:
+    """
+    LRU bounded by total PNG bytes and entry count. Each entry keeps the PNG and,
+    once Telegram has stored it, the file_id so later sends need no upload at all.
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.file_id_hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if entry.file_id:
+            self.file_id_hits += 1
+        return entry
+
+    def put(self, key: str, png: bytes):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old.png)
+        if len(png) > self.max_bytes:
+            return
+        self._entries[key] = CachedImage(png)
+        self._bytes += len(png)
+        while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.png)
+
+    def set_file_id(self, key: str, file_id: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.file_id = file_id
+
+    def forget_file_id(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.file_id = None
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'file_id_hits': self.file_id_hits,
+            'misses': self.misses,
+        }
+
+
+cache = ImageCache(IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_MAX_ENTRIES)
@@ -1,7 +1,6 @@
 # leaderboard_manager.py (FINAL VERSION 16: Added get_chat_stats for /chats command)
 
 import os
-import psycopg2
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, constants, InputMediaPhoto
 from telegram.ext import ContextTypes, CallbackContext
@@ -10,8 +9,19 @@ import logging
 import asyncio
 import telegram.error
 import io
-from PIL import Image, ImageDraw, ImageFont, ImageOps
 import re 
+import threading
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import db
+import metrics
+import migrations
+import chat_cache
+import image_cache
+import photo_cache
+import message_ingest
+import ranking_index
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +31,14 @@ FONT_NAMES = "NotoSans-Regular.ttf"
 FONT_FALLBACK = "arial.ttf" 
 BACKGROUND_IMAGE_PATH = "25552 (1).jpg" 
 
+# Rendering runs on a 'thread' or 'process' pool; beyond RENDER_QUEUE_MAX pending renders we send text only
+RENDER_POOL_KIND = os.environ.get('RENDER_POOL_KIND', 'thread')
+RENDER_POOL_WORKERS = int(os.environ.get('RENDER_POOL_WORKERS', '2'))
+RENDER_QUEUE_MAX = int(os.environ.get('RENDER_QUEUE_MAX', '8'))
+
+# Chats that reject a broadcast are deactivated in one UPDATE per this many
+DEACTIVATE_FLUSH_SIZE = int(os.environ.get('DEACTIVATE_FLUSH_SIZE', '100'))
+
 # Image Dimensions 
 IMG_WIDTH = 900  
 HEADER_HEIGHT = 160  
@@ -38,99 +56,39 @@ COLOR_RANK_2 = (192, 192, 192)
 COLOR_RANK_3 = (205, 127, 50)   
 COLOR_DIVIDER = (51, 65, 85)
 
-# --- 👑 Bot Owner (Unchanged) ---
-OWNER_ID = os.environ.get('OWNER_ID')
-if not OWNER_ID:
-    logger.warning("OWNER_ID environment variable is not set. Broadcast command will be disabled.")
-# --- End Owner ---
-
-# --- Database Connection (Unchanged) ---
-def get_db_connection():
-    DB_URL = os.environ.get('DATABASE_URL')
-    if not DB_URL:
-        logger.error("DATABASE_URL environment variable is not set.")
-        return None
+# --- Database Setup (Versioned migrations, run once at boot) ---
+async def setup_database():
+    if not db.pool.is_open: return
     try:
-        conn = psycopg2.connect(DB_URL, sslmode='require')
-        return conn
+        version = await db.pool.run(migrations.run_migrations)
+        logger.info(f"Database setup complete. Schema version {version}.")
     except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        return None
-
-# --- Database Setup (Unchanged from V15) ---
-def setup_database():
-    conn = get_db_connection()
-    if conn:
-        try:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS messages (
-                        id BIGSERIAL PRIMARY KEY,
-                        chat_id BIGINT NOT NULL,
-                        user_id BIGINT NOT NULL,
-                        username VARCHAR(255),
-                        message_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS chats (
-                        chat_id BIGINT PRIMARY KEY,
-                        chat_name VARCHAR(255),
-                        chat_type VARCHAR(50),
-                        last_activity TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                        is_active BOOLEAN DEFAULT TRUE NOT NULL,
-                        quiz_message_count INT DEFAULT 0 NOT NULL
-                    );
-                """)
-                
-                def check_and_add_column(cur, table, column, definition):
-                    try:
-                        cur.execute(f"SELECT {column} FROM {table} LIMIT 1;")
-                    except psycopg2.ProgrammingError:
-                        conn.rollback()
-                        logger.warning(f"Adding '{column}' column to existing '{table}' table.")
-                        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition};")
-                        conn.commit()
-
-                check_and_add_column(cur, 'chats', 'chat_type', 'VARCHAR(50)')
-                check_and_add_column(cur, 'chats', 'is_active', 'BOOLEAN DEFAULT TRUE NOT NULL') 
-                check_and_add_column(cur, 'chats', 'quiz_message_count', 'INT DEFAULT 0 NOT NULL')
-
-            conn.commit()
-            logger.info("Database setup complete.")
-        except Exception as e:
-            logger.error(f"Database setup failed: {e}")
-            conn.rollback()
-        finally:
-            if conn:
-                conn.close()
+        logger.error(f"Database setup failed: {e}")
 
-# --- Chat Registration (Unchanged) ---
-def register_chat(update: Update):
-    conn = get_db_connection()
-    if not conn: return
+# --- Chat Registration (Debounced through chat_cache) ---
+async def register_chat(update: Update):
+    if not db.pool.is_open: return
     chat = update.effective_chat
     chat_id = chat.id
     chat_name = chat.title or (chat.username or chat.first_name)
     chat_type = chat.type
+    # Skip the upsert unless name/type changed or the stored last_activity is stale
+    if not chat_cache.cache.claim_write(chat_id, chat_name, chat_type):
+        return
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO chats (chat_id, chat_name, chat_type, last_activity, is_active)
-                VALUES (%s, %s, %s, NOW(), TRUE)
-                ON CONFLICT (chat_id) DO UPDATE
-                SET last_activity = NOW(), chat_name = %s, chat_type = %s, is_active = TRUE;
-            """, (chat_id, chat_name, chat_type, chat_name, chat_type))
-        conn.commit()
+        await db.execute("""
+            INSERT INTO chats (chat_id, chat_name, chat_type, last_activity, is_active)
+            VALUES (%s, %s, %s, NOW(), TRUE)
+            ON CONFLICT (chat_id) DO UPDATE
+            SET last_activity = NOW(), chat_name = %s, chat_type = %s, is_active = TRUE;
+        """, (chat_id, chat_name, chat_type, chat_name, chat_type))
     except Exception as e:
+        chat_cache.cache.invalidate(chat_id)
         logger.error(f"Failed to register chat: {e}")
-    finally:
-        if conn: conn.close()
 
 # --- Message Count Update (Unchanged) ---
 async def update_message_count_db(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = get_db_connection()
-    if not conn: return
+    # No pool check: during startup the ingestor queues events until the pool is open
     chat_id = update.effective_chat.id
     user = update.effective_user
     user_id = user.id
@@ -140,56 +98,111 @@ async def update_message_count_db(update: Update, context: ContextTypes.DEFAULT_
     if user.last_name:
         display_name = f"{user.first_name} {user.last_name}"
 
-    register_chat(update)
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO messages (chat_id, user_id, username)
-                VALUES (%s, %s, %s);
-            """, (chat_id, user_id, display_name))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Failed to update message count in DB: {e}")
-    finally:
-        if conn: conn.close()
+    await register_chat(update)
+    # Buffered: the row is written by the next batched flush, not by this handler
+    message_ingest.ingestor.submit(chat_id, user_id, display_name, update.effective_message.date)
 
 
-# --- 🖼️ Leaderboard Image Generator (Unchanged from V15) ---
-def generate_leaderboard_image(title: str, leaderboard_data: list, chat_name: str, total_count: int):
-    # Helper to load font safely
-    def get_font(name, size):
-        try:
-            return ImageFont.truetype(name, size)
-        except IOError:
+# --- 🗂️ Render Asset Cache ---
+# Leaderboards show at most this many rows, so only this many + 1 background heights exist
+MAX_LEADERBOARD_ROWS = 10
+
+def get_image_height(row_count: int) -> int:
+    content_height = max(100, row_count * ROW_HEIGHT) 
+    return HEADER_HEIGHT + content_height + FOOTER_HEIGHT
+
+class RenderAssets:
+    """
+    Process-wide cache of fonts and pre-scaled backgrounds for generate_leaderboard_image.
+    Everything is loaded once; renders only copy the background for their height.
+    """
+
+    def __init__(self):
+        self._fonts = {}
+        self._backgrounds = {}
+        self._font_bytes = 0
+        self._lock = threading.Lock()
+
+    def font(self, name: str, size: int):
+        key = (name, size)
+        font = self._fonts.get(key)
+        if font is None:
+            with self._lock:
+                font = self._fonts.get(key)
+                if font is None:
+                    font = self._load_font(name, size)
+                    self._fonts[key] = font
+        return font
+
+    def _load_font(self, name, size):
+        # Pillow is imported on first render or warm-up, not when the bot boots
+        from PIL import ImageFont
+        # Helper to load font safely
+        for path in (name, FONT_FALLBACK):
             try:
-                return ImageFont.truetype(FONT_FALLBACK, size)
-            except:
-                return ImageFont.load_default()
-
-    # Load Fonts 
-    font_title = get_font(FONT_MAIN, 45) 
-    font_sub = get_font(FONT_MAIN, 28)    
-    font_text = get_font(FONT_NAMES, 24) 
-    font_rank = get_font(FONT_MAIN, 26) 
+                font = ImageFont.truetype(path, size)
+                if os.path.exists(path):
+                    self._font_bytes += os.path.getsize(path)
+                return font
+            except IOError:
+                continue
+        return ImageFont.load_default()
+
+    def background(self, height: int):
+        """Returns the background stretched to (IMG_WIDTH, height), or None if it cannot be loaded."""
+        if height not in self._backgrounds:
+            with self._lock:
+                if height not in self._backgrounds:
+                    self._backgrounds[height] = self._load_background(height)
+        return self._backgrounds[height]
+
+    def _load_background(self, height):
+        from PIL import Image
+        try:
+            with Image.open(BACKGROUND_IMAGE_PATH) as source:
+                # Strict Action: Scale/Stretch the BG image to exactly match the dynamic dimensions.
+                return source.convert("RGB").resize((IMG_WIDTH, height), Image.LANCZOS)
+        except Exception as e:
+            logger.error(f"Error loading background image: {e}. Using solid color fallback.")
+            return None
+
+    def warm(self):
+        for name, size in ((FONT_MAIN, 45), (FONT_MAIN, 28), (FONT_NAMES, 24), (FONT_MAIN, 26)):
+            self.font(name, size)
+        for row_count in range(MAX_LEADERBOARD_ROWS + 1):
+            self.background(get_image_height(row_count))
+        logger.info(f"Render assets warmed: {self.stats()}")
+
+    def stats(self) -> dict:
+        background_bytes = sum(
+            bg.width * bg.height * len(bg.getbands()) for bg in self._backgrounds.values() if bg is not None
+        )
+        return {
+            'fonts': len(self._fonts),
+            'backgrounds': len(self._backgrounds),
+            'font_file_bytes': self._font_bytes,
+            'background_bytes': background_bytes,
+        }
+
+render_assets = RenderAssets()
+
+# --- 🖼️ Leaderboard Image Generator (Assets from render_assets) ---
+def generate_leaderboard_image(title: str, leaderboard_data: list, chat_name: str, total_count: int):
+    from PIL import Image, ImageDraw
+    # Fonts (cached)
+    font_title = render_assets.font(FONT_MAIN, 45) 
+    font_sub = render_assets.font(FONT_MAIN, 28)    
+    font_text = render_assets.font(FONT_NAMES, 24) 
+    font_rank = render_assets.font(FONT_MAIN, 26) 
     
     # Dynamic Height Calculation 
-    content_height = max(100, len(leaderboard_data) * ROW_HEIGHT) 
-    total_height = HEADER_HEIGHT + content_height + FOOTER_HEIGHT
+    total_height = get_image_height(len(leaderboard_data))
 
-    # --- Load Background Image (STRICT ACTION: Scale/Stretch to exact dynamic size) ---
-    try:
-        bg_img = Image.open(BACKGROUND_IMAGE_PATH).convert("RGB")
-        
-        # Strict Action: Scale/Stretch the BG image to exactly match the dynamic dimensions.
-        bg_img = bg_img.resize((IMG_WIDTH, total_height), Image.LANCZOS)
-        
-        img = Image.new('RGB', (IMG_WIDTH, total_height), color=COLOR_BG)
-        
-        # Paste the stretched background image, ensuring full coverage
-        img.paste(bg_img, (0, 0)) 
-            
-    except Exception as e:
-        logger.error(f"Error loading background image: {e}. Using solid color fallback.")
+    # --- Background (pre-scaled per height, copied so the cached one stays clean) ---
+    bg_img = render_assets.background(total_height)
+    if bg_img is not None:
+        img = bg_img.copy()
+    else:
         img = Image.new('RGB', (IMG_WIDTH, total_height), color=COLOR_BG)
         
     d = ImageDraw.Draw(img)
@@ -258,35 +271,171 @@ def generate_leaderboard_image(title: str, leaderboard_data: list, chat_name: st
     bio.seek(0)
     return bio
 
+# --- 🧵 Render Worker Pool ---
+class RenderQueueFull(Exception):
+    pass
+
+def _render_png(title, leaderboard_data, chat_name, total_count) -> bytes:
+    # Runs in a worker; returns bytes so the result can also cross a process boundary
+    return generate_leaderboard_image(title, leaderboard_data, chat_name, total_count).getvalue()
+
+def _init_render_process():
+    render_assets.warm()
+
+class RenderPool:
+    """
+    Runs generate_leaderboard_image on a thread or process pool so Pillow work never
+    blocks the event loop. At most max_pending renders may be running or queued.
+    """
+
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._executor:
+            return
+        if self.kind == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_render_process)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='render')
+        logger.info(f"Render pool started ({self.kind}, workers={self.workers}, max pending={self.max_pending}).")
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, title, leaderboard_data, chat_name, total_count) -> bytes:
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise RenderQueueFull(f"{self._pending} renders already pending.")
+        self.start()
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, _render_png, title, list(leaderboard_data), chat_name, total_count
+            )
+        finally:
+            self._pending -= 1
+            metrics.render_seconds.observe(time.perf_counter() - started, self.kind)
+
+    def stats(self) -> dict:
+        return {'kind': self.kind, 'pending': self._pending, 'max_pending': self.max_pending, 'rejected': self.rejected}
+
+render_pool = RenderPool(RENDER_POOL_KIND, RENDER_POOL_WORKERS, RENDER_QUEUE_MAX)
+
+# --- Rendered Image Cache Helpers ---
+async def get_leaderboard_photo(title: str, leaderboard_data: list, chat_name: str, total_count: int):
+    """
+    Returns (cache_key, photo). photo is the Telegram file_id of an earlier upload of the
+    identical ranking when known, otherwise the PNG bytes (rendered only on a cache miss).
+    photo is None when the render pool is saturated; callers fall back to text only.
+    """
+    key = image_cache.make_key(title, chat_name, leaderboard_data, total_count)
+    cached = image_cache.cache.get(key)
+    if cached is not None:
+        return key, cached.file_id or cached.png
+    try:
+        png = await render_pool.render(title, leaderboard_data, chat_name, total_count)
+    except RenderQueueFull as e:
+        logger.warning(f"Render queue full, sending text-only leaderboard: {e}")
+        return key, None
+    image_cache.cache.put(key, png)
+    return key, png
+
+def remember_leaderboard_file_id(key: str, message):
+    # edit_message_media returns True instead of a Message for inline messages
+    if isinstance(message, telegram.Message) and message.photo:
+        image_cache.cache.set_file_id(key, message.photo[-1].file_id)
+
 # --- Leaderboard Core Logic (Unchanged from V15) ---
+def _fetch_leaderboard_rows(conn, chat_id, query, total_query, params, fetch_chat_name):
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        results = cur.fetchall() 
+        
+        cur.execute(total_query, params)
+        total_count = cur.fetchone()[0]
+
+        chat_name = None
+        if fetch_chat_name:
+            chat_name_query = "SELECT chat_name FROM chats WHERE chat_id = %s;"
+            cur.execute(chat_name_query, (chat_id,))
+            chat_name_result = cur.fetchone()
+            if chat_name_result:
+                chat_name = chat_name_result[0]
+    return results, total_count, chat_name
+
+def _fetch_chat_name(conn, chat_id):
+    with conn.cursor() as cur:
+        cur.execute("SELECT chat_name FROM chats WHERE chat_id = %s;", (chat_id,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+async def get_chat_name(chat_id: int) -> str:
+    chat_name = chat_cache.cache.get_name(chat_id)
+    if chat_name is not None:
+        return chat_name
+    try:
+        chat_name = await db.pool.run(_fetch_chat_name, chat_id)
+    except Exception as e:
+        logger.error(f"Failed to fetch chat name for {chat_id}: {e}")
+        chat_name = None
+    if chat_name is None:
+        return "This Chat"
+    chat_cache.cache.store(chat_id, chat_name)
+    return chat_name
+
 async def get_leaderboard_data(chat_id: int, scope: str, current_user_id: int = None):
-    conn = get_db_connection()
-    if not conn:
+    if not await db.pool.wait_ready():
         return ("Database Error", "Unknown", [], 0, None)
 
     time_filter = ""
     chat_filter = ""
     title = ""
+    params = []
+    # All-time scopes read user_chat_totals: the daily rollup and raw rows may be pruned by retention
+    source_table = "message_counts_daily"
 
-    # Scope Logic
+    # Scope Logic (daily/weekly read the message_counts_daily rollup; days are UTC calendar days)
     if scope == 'global':
+        source_table = "user_chat_totals"
         title = "Global All-Time Legends"
         chat_filter = ""
     elif scope == 'daily':
-        time_filter = "message_time >= NOW() - INTERVAL '1 day'"
+        time_filter = "day = (NOW() AT TIME ZONE 'UTC')::date"
         title = "Today's Top Chatters"
-        chat_filter = f"chat_id = {chat_id}"
+        chat_filter = "chat_id = %s"
+        params.append(chat_id)
     elif scope == 'weekly':
-        time_filter = "message_time >= NOW() - INTERVAL '7 days'"
+        time_filter = "day > (NOW() AT TIME ZONE 'UTC')::date - 7"
         title = "Weekly Top Chatters"
-        chat_filter = f"chat_id = {chat_id}"
+        chat_filter = "chat_id = %s"
+        params.append(chat_id)
     elif scope == 'alltime':
+        source_table = "user_chat_totals"
         title = "All-Time Legends (Local Chat)" 
-        chat_filter = f"chat_id = {chat_id}"
+        chat_filter = "chat_id = %s"
+        params.append(chat_id)
     else:
         logger.warning(f"Invalid leaderboard scope received: {scope}")
         return ("Invalid Scope", "Error", [], 0, None)
 
+    # In-memory boards answer without Postgres once built; the SQL below is the fallback
+    indexed = await ranking_index.index.leaderboard(scope, chat_id, current_user_id, MAX_LEADERBOARD_ROWS)
+    if indexed is not None:
+        results, total_count, current_user_data = indexed
+        chat_name = "All Registered Chats"
+        if scope != 'global':
+            chat_name = await get_chat_name(chat_id)
+        return (title, chat_name, results, total_count, current_user_data)
+
     filters = []
     if chat_filter: filters.append(chat_filter)
     if time_filter: filters.append(time_filter)
@@ -294,38 +443,26 @@ async def get_leaderboard_data(chat_id: int, scope: str, current_user_id: int =
 
     # 1. Query for Top 10 users
     query = f"""
-        WITH RankedMessages AS (
-            SELECT
-                user_id,
-                username,
-                message_time,
-                ROW_NUMBER() OVER(PARTITION BY user_id ORDER BY message_time DESC) as rn
-            FROM messages
-            WHERE user_id IN (SELECT DISTINCT user_id FROM messages {where_clause})
-        ),
-        LatestUsernames AS (
-            SELECT user_id, username
-            FROM RankedMessages
-            WHERE rn = 1
-        ),
-        UserCounts AS (
+        WITH UserCounts AS (
             SELECT
                 user_id,
-                COUNT(*) AS total_messages
-            FROM messages
+                SUM(message_count) AS total_messages
+            FROM {source_table}
             {where_clause}
             GROUP BY user_id
+            ORDER BY total_messages DESC
+            LIMIT 10
         )
         SELECT
-            lu.username,
+            u.display_name,
             uc.total_messages,
             uc.user_id  
         FROM UserCounts uc
-        JOIN LatestUsernames lu ON uc.user_id = lu.user_id
+        LEFT JOIN users u ON uc.user_id = u.user_id
         ORDER BY uc.total_messages DESC
         LIMIT 10;
     """
-    total_query = f"SELECT COUNT(*) FROM messages {where_clause};"
+    total_query = f"SELECT COALESCE(SUM(message_count), 0) FROM {source_table} {where_clause};"
     
     # 2. Query for Current User's Stats (Rank and Count)
     current_user_data = None
@@ -334,9 +471,9 @@ async def get_leaderboard_data(chat_id: int, scope: str, current_user_id: int =
             WITH UserCounts AS (
                 SELECT
                     user_id,
-                    COUNT(*) AS total_messages,
-                    RANK() OVER (ORDER BY COUNT(*) DESC) as user_rank
-                FROM messages
+                    SUM(message_count) AS total_messages,
+                    RANK() OVER (ORDER BY SUM(message_count) DESC) as user_rank
+                FROM {source_table}
                 {where_clause}
                 GROUP BY user_id
             )
@@ -344,44 +481,39 @@ async def get_leaderboard_data(chat_id: int, scope: str, current_user_id: int =
                 uc.total_messages,
                 uc.user_rank
             FROM UserCounts uc
-            WHERE uc.user_id = {current_user_id};
+            WHERE uc.user_id = %s;
         """
         try:
-            with conn.cursor() as cur:
-                cur.execute(user_stats_query)
-                stats_result = cur.fetchone()
-                if stats_result:
-                    # (rank, count) - rank is float from RANK(), count is int/long
-                    current_user_data = (int(stats_result[1]), stats_result[0])
+            stats_result = await db.fetchone(user_stats_query, params + [current_user_id])
+            if stats_result:
+                # (rank, count) - rank is float from RANK(), count is int/long
+                current_user_data = (int(stats_result[1]), stats_result[0])
         except Exception as e:
             logger.error(f"Failed to fetch current user stats: {e}")
             
     chat_name = "All Registered Chats" # Default for global
+    cached_chat_name = None
+    if scope != 'global':
+        cached_chat_name = chat_cache.cache.get_name(chat_id)
 
     try:
-        with conn.cursor() as cur:
-            cur.execute(query)
-            results = cur.fetchall() 
-            
-            cur.execute(total_query)
-            total_count = cur.fetchone()[0]
-
-            if scope != 'global':
-                chat_name_query = "SELECT chat_name FROM chats WHERE chat_id = %s;"
-                cur.execute(chat_name_query, (chat_id,))
-                chat_name_result = cur.fetchone()
-                if chat_name_result:
-                    chat_name = chat_name_result[0]
-                else:
-                    chat_name = "This Chat"
-
+        fetch_chat_name = scope != 'global' and cached_chat_name is None
+        results, total_count, db_chat_name = await db.pool.run(
+            _fetch_leaderboard_rows, chat_id, query, total_query, params, fetch_chat_name
+        )
+        if scope != 'global':
+            if cached_chat_name is not None:
+                chat_name = cached_chat_name
+            elif db_chat_name is not None:
+                chat_name = db_chat_name
+                chat_cache.cache.store(chat_id, db_chat_name)
+            else:
+                chat_name = "This Chat"
         return (title, chat_name, results, total_count, current_user_data)
 
     except Exception as e:
         logger.error(f"Failed to fetch leaderboard: {e}. Query: {query}")
         return ("Database Query Error", "Error", [], 0, None)
-    finally:
-        if conn: conn.close()
 
 # --- Format Leaderboard Text (Unchanged from V15) ---
 def format_leaderboard_text(title: str, chat_name: str, data: list, total_count: int, user_stats: tuple, current_user_name: str):
@@ -440,7 +572,8 @@ def format_leaderboard_text(title: str, chat_name: str, data: list, total_count:
 
     return leaderboard_text
 
-# --- Helper function for ticked buttons (Unchanged from V15) ---
+# --- Helper function for ticked buttons (Markups are immutable, so they are built once per scope/chat) ---
+@functools.lru_cache(maxsize=4096)
 def create_leaderboard_keyboard(scope: str, chat_id: int):
     daily_text = "Today"
     weekly_text = "Weekly"
@@ -503,20 +636,27 @@ async def ranking_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Pass all data to formatter
-    image_bytes = generate_leaderboard_image(title, data, chat_name, total)
+    image_key, photo = await get_leaderboard_photo(title, data, chat_name, total)
     caption_text = format_leaderboard_text(title, chat_name, data, total, user_stats, current_user_name)
     reply_markup = create_leaderboard_keyboard('daily', chat_id)
 
+    if photo is None:
+        await sent_message.edit_text(caption_text, reply_markup=reply_markup, parse_mode=constants.ParseMode.MARKDOWN_V2)
+        return
+
     try:
         await sent_message.delete()
-        await context.bot.send_photo(
+        photo_message = await context.bot.send_photo(
             chat_id=chat_id,
-            photo=image_bytes,
+            photo=photo,
             caption=caption_text,
             reply_markup=reply_markup,
             parse_mode=constants.ParseMode.MARKDOWN_V2
         )
+        remember_leaderboard_file_id(image_key, photo_message)
     except Exception as e:
+        # A stale file_id must not be reused; the next request re-uploads the cached PNG
+        image_cache.cache.forget_file_id(image_key)
         logger.error(f"Failed to send ranking photo: {e}. Sending text fallback.")
         await context.bot.send_message(
             chat_id=chat_id,
@@ -555,27 +695,62 @@ async def leaderboard_callback(update: Update, context: CallbackContext):
         return
 
     # Pass all data to formatter
-    image_bytes = generate_leaderboard_image(title, data, chat_name, total)
+    image_key, photo = await get_leaderboard_photo(title, data, chat_name, total)
     caption_text = format_leaderboard_text(title, chat_name, data, total, user_stats, current_user_name)
     reply_markup = create_leaderboard_keyboard(scope, chat_id)
 
     try:
-        await query.edit_message_media(
-            media=InputMediaPhoto(media=image_bytes, caption=caption_text, parse_mode=constants.ParseMode.MARKDOWN_V2),
+        if photo is None:
+            # Render pool saturated: keep the old picture, update the caption and buttons only
+            if query.message and query.message.photo:
+                await query.edit_message_caption(caption=caption_text, reply_markup=reply_markup, parse_mode=constants.ParseMode.MARKDOWN_V2)
+            else:
+                await query.edit_message_text(caption_text, reply_markup=reply_markup, parse_mode=constants.ParseMode.MARKDOWN_V2)
+            return
+        edited_message = await query.edit_message_media(
+            media=InputMediaPhoto(media=photo, caption=caption_text, parse_mode=constants.ParseMode.MARKDOWN_V2),
             reply_markup=reply_markup
         )
+        remember_leaderboard_file_id(image_key, edited_message)
     except telegram.error.BadRequest as e:
         if "Message is not modified" not in str(e):
+            image_cache.cache.forget_file_id(image_key)
             logger.warning(f"Failed to edit message media: {e}")
         pass
     except Exception as e:
         logger.error(f"Error during final leaderboard edit: {e}")
 
 
-# --- Profile Command (Unchanged from V15) ---
+# --- Profile Command (Served from user_chat_totals) ---
+def _fetch_profile_rows(conn, user_id):
+    with conn.cursor() as cur:
+        # One primary-key range read; totals are maintained by message ingestion
+        cur.execute("""
+            SELECT t.chat_id, COALESCE(c.chat_name, 'Unknown Chat'), t.message_count
+            FROM user_chat_totals t
+            LEFT JOIN chats c ON t.chat_id = c.chat_id
+            WHERE t.user_id = %s
+            ORDER BY t.message_count DESC;
+        """, (user_id,))
+        group_stats = cur.fetchall()
+    total_messages = sum(count for _, _, count in group_stats)
+    return total_messages, group_stats
+
+async def get_profile_photo_file_id(bot, user_id):
+    """Latest profile photo file_id (or None), cached for PROFILE_PHOTO_TTL seconds."""
+    file_id = photo_cache.cache.get(user_id)
+    if file_id is not photo_cache.MISSING:
+        return file_id
+    photos = await bot.get_user_profile_photos(user_id, limit=1)
+    file_id = None
+    if photos.photos and photos.photos[0]:
+        # Get the largest photo file_id of the latest photo
+        file_id = photos.photos[0][-1].file_id
+    photo_cache.cache.put(user_id, file_id)
+    return file_id
+
 async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = get_db_connection()
-    if not conn:
+    if not await db.pool.wait_ready():
         await update.message.reply_text("*Database is offline\.* Profile unavailable\.")
         return
 
@@ -591,44 +766,34 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     profile_text = f"👤 *{username}'s Profile Stats* 📈\n\n"
 
     try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) FROM messages WHERE user_id = %s;", (user_id,))
-            total_messages = cur.fetchone()[0]
-            
-            # Escape parentheses in the stats line
-            profile_text += f"**Total Messages \(All Time\):** {total_messages}\n\n"
-
-            # Query uses LEFT JOIN and COALESCE (Unchanged robust logic)
-            cur.execute("""
-                SELECT m.chat_id, COALESCE(c.chat_name, 'Unknown Chat'), COUNT(*) AS count
-                FROM messages m
-                LEFT JOIN chats c ON m.chat_id = c.chat_id
-                WHERE m.user_id = %s
-                GROUP BY m.chat_id, COALESCE(c.chat_name, 'Unknown Chat')
-                ORDER BY count DESC;
-            """, (user_id,))
-            group_stats = cur.fetchall()
-
-            profile_text += "*Messages per Group:*\n"
-            if not group_stats:
-                profile_text += "No group data found\."
-            else:
-                for chat_id, chat_name, count in group_stats:
-                    # Escape chat name (which might contain reserved chars like '(' or ')' from the DB)
-                    chat_name_for_display = chat_name[:25]
-                    escaped_chat_name = escape_markdown(chat_name_for_display, version=2)
-                    
-                    suffix = escape_markdown("...", version=2) if len(chat_name) > 25 else ""
-                    profile_text += f"• {escaped_chat_name}{suffix}: {count}\n"
+        # The pooled connection is released here, before any Telegram call below
+        total_messages, group_stats = await db.pool.run(_fetch_profile_rows, user_id)
             
-            # --- NEW: Fetch and Send Profile Photo ---
-            photos = await context.bot.get_user_profile_photos(user_id, limit=1)
-            photo_file_id = None
-            if photos.photos and photos.photos[0]:
-                # Get the largest photo file_id of the latest photo
-                photo_file_id = photos.photos[0][-1].file_id
-
-            if photo_file_id:
+        # Escape parentheses in the stats line
+        profile_text += f"**Total Messages \(All Time\):** {total_messages}\n\n"
+
+        profile_text += "*Messages per Group:*\n"
+        if not group_stats:
+            profile_text += "No group data found\."
+        else:
+            for chat_id, chat_name, count in group_stats:
+                # Escape chat name (which might contain reserved chars like '(' or ')' from the DB)
+                chat_name_for_display = chat_name[:25]
+                escaped_chat_name = escape_markdown(chat_name_for_display, version=2)
+                
+                suffix = escape_markdown("...", version=2) if len(chat_name) > 25 else ""
+                profile_text += f"• {escaped_chat_name}{suffix}: {count}\n"
+    except Exception as e:
+        logger.error(f"Failed to fetch user profile: {e}")
+        await update.message.reply_text("Database query error while fetching profile\.")
+        return
+
+    try:
+        # --- Fetch and Send Profile Photo (file_id cached) ---
+        photo_file_id = await get_profile_photo_file_id(context.bot, user_id)
+
+        if photo_file_id:
+            try:
                 # Send photo with profile text as caption
                 await context.bot.send_photo(
                     chat_id=update.effective_chat.id,
@@ -636,182 +801,135 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     caption=profile_text,
                     parse_mode=constants.ParseMode.MARKDOWN_V2
                 )
-            else:
-                # Send text only if no photo found
-                await update.message.reply_text(profile_text, parse_mode=constants.ParseMode.MARKDOWN_V2)
-
+                return
+            except telegram.error.BadRequest as e:
+                # Photo removed or file_id no longer valid; look it up again next time
+                logger.warning(f"Cached profile photo for {user_id} rejected: {e}")
+                photo_cache.cache.forget(user_id)
+        # Send text only if no photo found
+        await update.message.reply_text(profile_text, parse_mode=constants.ParseMode.MARKDOWN_V2)
     except Exception as e:
-        logger.error(f"Failed to fetch user profile: {e}")
-        await update.message.reply_text("Database query error while fetching profile\.")
-    finally:
-        if conn: conn.close()
-
-# --- Broadcast Feature (Unchanged) ---
-async def send_broadcast_and_handle_errors(context: ContextTypes.DEFAULT_TYPE, chat_id, from_chat_id, message_id):
-    try:
-        await context.bot.copy_message(
-            chat_id=chat_id,
-            from_chat_id=from_chat_id,
-            message_id=message_id
-        )
-        return (chat_id, "Success")
-    except (telegram.error.Forbidden, telegram.error.BadRequest) as e:
-        logger.warning(f"Broadcast failed for {chat_id} (Forbidden/Bad Request). Deactivating: {e}")
-        deactivate_chat_in_db(chat_id)
-        return (chat_id, "Failed_Deactivated")
-    except Exception as e:
-        logger.error(f"Broadcast failed for {chat_id} (Other): {e}")
-        return (chat_id, "Failed_Error")
-
-async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not OWNER_ID:
-        await update.message.reply_text("Bot owner ID is not configured. Broadcast disabled.")
-        logger.error("Broadcast command used but OWNER_ID is not set.")
-        return
-    if str(update.effective_user.id) != str(OWNER_ID):
-        await update.message.reply_text("This is an owner-only command.")
-        return
-    if update.effective_chat.type not in [constants.ChatType.PRIVATE]:
-        await update.message.reply_text("This command must be used in a private chat.")
-        return
-    if not update.message.reply_to_message:
-        await update.message.reply_text("Please reply to the message you want to broadcast.")
-        return
-
-    broadcast_message = update.message.reply_to_message
-    chat_ids = get_all_active_chat_ids()
-    if not chat_ids:
-        await update.message.reply_text("No active chats found to broadcast to.")
-        return
-
-    await update.message.reply_text(f"Starting broadcast... Sending to {len(chat_ids)} chats.")
-    tasks = [
-        send_broadcast_and_handle_errors(
-            context,
-            chat_id,
-            update.effective_chat.id,
-            broadcast_message.message_id
-        )
-        for chat_id in chat_ids
-    ]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    success_count = 0
-    for res in results:
-        if isinstance(res, tuple) and res[1] == "Success":
-            success_count += 1
-        elif isinstance(res, Exception):
-            logger.error(f"An unexpected error occurred during broadcast gather: {res}")
-    await update.message.reply_text(f"✅ Broadcast complete! Successfully sent to {success_count} / {len(tasks)} chats.")
+        logger.error(f"Failed to send user profile: {e}")
 
 # --- Quiz Counter DB Functions (Unchanged) ---
 
-def increment_and_get_quiz_count(chat_id):
-    conn = get_db_connection()
-    if not conn: return 0
+async def increment_and_get_quiz_count(chat_id):
+    if not db.pool.is_open: return 0
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE chats
-                SET quiz_message_count = quiz_message_count + 1
-                WHERE chat_id = %s
-                RETURNING quiz_message_count;
-            """, (chat_id,))
-            result = cur.fetchone()
-            conn.commit()
-            if result:
-                return result[0]
-            else:
-                logger.warning(f"Could not increment count for chat {chat_id}, maybe not registered? (This is normal if it's the very first message)")
-                return 0
+        result = await db.fetchone("""
+            UPDATE chats
+            SET quiz_message_count = quiz_message_count + 1
+            WHERE chat_id = %s
+            RETURNING quiz_message_count;
+        """, (chat_id,))
+        if result:
+            return result[0]
+        else:
+            logger.warning(f"Could not increment count for chat {chat_id}, maybe not registered? (This is normal if it's the very first message)")
+            return 0
     except Exception as e:
         logger.error(f"Failed to increment quiz count for {chat_id}: {e}")
-        conn.rollback()
         return 0
-    finally:
-        if conn: conn.close()
 
-def reset_quiz_count(chat_id):
-    conn = get_db_connection()
-    if not conn: return
+async def reset_quiz_count(chat_id):
+    if not db.pool.is_open: return
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE chats
-                SET quiz_message_count = 0
-                WHERE chat_id = %s;
-            """, (chat_id,))
-        conn.commit()
+        await db.execute("""
+            UPDATE chats
+            SET quiz_message_count = 0
+            WHERE chat_id = %s;
+        """, (chat_id,))
     except Exception as e:
         logger.error(f"Failed to reset quiz count for {chat_id}: {e}")
-        conn.rollback()
-    finally:
-        if conn: conn.close()
 
 # --- Utility Functions (MODIFIED: Added get_chat_stats) ---
-def get_chat_stats():
+def _fetch_chat_stats(conn):
+    with conn.cursor() as cur:
+        # Count active group/supergroup chats
+        cur.execute("""
+            SELECT COUNT(*) FROM chats 
+            WHERE is_active = TRUE AND chat_type IN ('group', 'supergroup');
+        """)
+        group_count = cur.fetchone()[0]
+
+        # Count active private chats (DMs)
+        cur.execute("""
+            SELECT COUNT(*) FROM chats 
+            WHERE is_active = TRUE AND chat_type = 'private';
+        """)
+        dm_count = cur.fetchone()[0]
+
+        # Count total messages for a general activity metric
+        cur.execute("SELECT COALESCE(SUM(message_count), 0) FROM user_chat_totals;")
+        total_messages = cur.fetchone()[0]
+
+    return {
+        'groups': group_count,
+        'dms': dm_count,
+        'total_messages': total_messages,
+    }
+
+async def get_chat_stats():
     """
     Fetches the count of active group/supergroup chats and private chats (DMs).
     Returns: A dictionary like {'groups': int, 'dms': int, 'total_messages': int} or None on error.
     """
-    conn = get_db_connection()
-    if not conn:
+    if not db.pool.is_open:
         logger.error("Failed to connect to DB for chat stats.")
         return None
     try:
-        with conn.cursor() as cur:
-            # Count active group/supergroup chats
-            cur.execute("""
-                SELECT COUNT(*) FROM chats 
-                WHERE is_active = TRUE AND chat_type IN ('group', 'supergroup');
-            """)
-            group_count = cur.fetchone()[0]
-
-            # Count active private chats (DMs)
-            cur.execute("""
-                SELECT COUNT(*) FROM chats 
-                WHERE is_active = TRUE AND chat_type = 'private';
-            """)
-            dm_count = cur.fetchone()[0]
-
-            # Count total messages for a general activity metric
-            cur.execute("SELECT COUNT(*) FROM messages;")
-            total_messages = cur.fetchone()[0]
-
-        return {
-            'groups': group_count,
-            'dms': dm_count,
-            'total_messages': total_messages,
-        }
+        return await db.pool.run(_fetch_chat_stats)
     except Exception as e:
         logger.error(f"Failed to fetch chat stats: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
-def get_all_active_chat_ids():
-    conn = get_db_connection()
-    if not conn: return set()
+async def get_all_active_chat_ids():
+    if not db.pool.is_open: return set()
     try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT chat_id FROM chats WHERE is_active = TRUE;")
-            chat_ids = {row[0] for row in cur.fetchall()}
-            return chat_ids
+        rows = await db.fetchall("SELECT chat_id FROM chats WHERE is_active = TRUE;")
+        return {row[0] for row in rows}
     except Exception as e:
         logger.error(f"Failed to fetch active chat IDs for broadcast: {e}")
         return set()
-    finally:
-        if conn: conn.close()
 
-def deactivate_chat_in_db(chat_id):
-    conn = get_db_connection()
-    if not conn: return
+async def deactivate_chats_in_db(chat_ids) -> int:
+    """One set-based UPDATE for many chats. Returns how many were still active."""
+    chat_ids = list(chat_ids)
+    if not chat_ids or not db.pool.is_open: return 0
     try:
-        with conn.cursor() as cur:
-            cur.execute("UPDATE chats SET is_active = FALSE WHERE chat_id = %s;", (chat_id,))
-        conn.commit()
-        logger.info(f"[DB] Deactivated chat: {chat_id}")
+        deactivated = await db.execute(
+            "UPDATE chats SET is_active = FALSE WHERE chat_id = ANY(%s) AND is_active = TRUE;",
+            (chat_ids,)
+        )
+        chat_cache.cache.mark_inactive(chat_ids)
+        logger.info(f"[DB] Deactivated {deactivated} chats ({len(chat_ids)} reported).")
+        return deactivated
     except Exception as e:
-        logger.error(f"[DB] Error deactivating chat {chat_id}: {e}")
-    finally:
-        if conn: conn.close()
+        logger.error(f"[DB] Error deactivating {len(chat_ids)} chats: {e}")
+        return 0
+
+class ChatDeactivator:
+    """
+    Collects chats that rejected a send during a broadcast and deactivates them
+    in batches of DEACTIVATE_FLUSH_SIZE, plus whatever is left on flush().
+    """
+
+    def __init__(self, flush_size: int = None):
+        self.flush_size = flush_size or DEACTIVATE_FLUSH_SIZE
+        self._pending = set()
+        self.reported = 0
+        self.deactivated = 0
+
+    async def add(self, chat_id):
+        self._pending.add(chat_id)
+        self.reported += 1
+        if len(self._pending) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        chat_ids, self._pending = self._pending, set()
+        deactivated = await deactivate_chats_in_db(sorted(chat_ids))
+        self.deactivated += deactivated
+        return deactivated
@@ -0,0 +1,150 @@
+# loop_watchdog.py (Event-loop lag monitor that logs the stack of whatever is blocking the loop)
+
+import os
+import sys
+import asyncio
+import logging
+import threading
+import time
+import traceback
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- ⚙️ Watchdog Configuration ---
+LOOP_WATCHDOG_ENABLED = os.environ.get('LOOP_WATCHDOG_ENABLED', '1') == '1'
+# Seconds between probes; lag is how late each probe wakes up
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', '0.1'))
+# Lag (seconds) that counts as a stall and triggers a stack capture
+LOOP_LAG_THRESHOLD = float(os.environ.get('LOOP_LAG_THRESHOLD', '0.25'))
+# At most one stall stack is logged per this many seconds; the rest are only counted
+LOOP_STACK_LOG_INTERVAL = float(os.environ.get('LOOP_STACK_LOG_INTERVAL', '60'))
+LOOP_STACK_DEPTH = int(os.environ.get('LOOP_STACK_DEPTH', '12'))
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+lag_seconds = metrics.registry.histogram('bot_loop_lag_seconds', 'How late the event loop ran a timer that was due', (), LAG_BUCKETS)
+
+
+class LoopWatchdog:
+    """
+    An asyncio task sleeps LOOP_LAG_INTERVAL in a loop and records how late it wakes up.
+    A helper thread watches the task's heartbeat: once it is older than the threshold the
+    loop is stuck in a call right now, so the thread grabs the loop thread's current frame
+    with sys._current_frames(). The task logs that stack when the loop comes back.
+    """
+
+    def __init__(self, interval: float, threshold: float, log_interval: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.log_interval = log_interval
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._loop_thread_id = None
+        # Written by the loop task, read by the helper thread; single assignments are atomic under the GIL
+        self._beat = 0.0
+        self._captured = None  # (beat, stack text) of the stall in progress
+        self._last_logged = 0.0
+        # Stats
+        self.samples = 0
+        self.stalls = 0
+        self.suppressed = 0
+        self.max_lag = 0.0
+        self.last_stall_at = None
+
+    def start(self):
+        if self._task or not LOOP_WATCHDOG_ENABLED:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._probe())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog started (interval {self.interval * 1000:.0f} ms, stall threshold {self.threshold * 1000:.0f} ms).")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._thread = None
+
+    # --- Loop side ---
+    async def _probe(self):
+        while True:
+            beat = time.perf_counter()
+            self._beat = beat
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - beat - self.interval)
+            self.samples += 1
+            self.max_lag = max(self.max_lag, lag)
+            lag_seconds.observe(lag)
+            if lag >= self.threshold:
+                self._report_stall(beat, lag)
+
+    def _report_stall(self, beat: float, lag: float):
+        self.stalls += 1
+        self.last_stall_at = time.time()
+        captured, self._captured = self._captured, None
+        stack = captured[1] if captured and captured[0] == beat else None
+        now = time.monotonic()
+        if now - self._last_logged < self.log_interval:
+            self.suppressed += 1
+            return
+        self._last_logged = now
+        note = f" ({self.suppressed} more stalls since the last report)" if self.suppressed else ""
+        self.suppressed = 0
+        if stack:
+            logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms{note}. Blocking call site:\n{stack}")
+        else:
+            logger.warning(f"Event loop lagged {lag * 1000:.0f} ms{note}; it recovered before a stack could be captured.")
+
+    # --- Helper thread ---
+    def _watch(self):
+        # Sample twice per threshold so a stall is caught while it is still happening
+        period = max(self.threshold / 2, 0.01)
+        while not self._stop.wait(period):
+            beat = self._beat
+            if time.perf_counter() - beat < self.interval + self.threshold:
+                continue
+            if self._captured and self._captured[0] == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame, limit=LOOP_STACK_DEPTH))
+            del frame
+            self._captured = (beat, stack)
+
+    # --- Reporting ---
+    def lag_quantile(self, q: float):
+        """Upper bucket bound (seconds) holding the q-quantile of observed lag, or None without samples."""
+        bounds, counts, _, count = lag_seconds.snapshot()
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip(bounds, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        # Beyond the last bucket: the largest lag seen is the tightest bound
+        return self.max_lag
+
+    def stats(self) -> dict:
+        return {
+            'samples': self.samples,
+            'stalls': self.stalls,
+            'max_lag_ms': self.max_lag * 1000,
+            'threshold_ms': self.threshold * 1000,
+        }
+
+
+watchdog = LoopWatchdog(LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD, LOOP_STACK_LOG_INTERVAL)
@@ -2,30 +2,47 @@
 
 import telegram
 from telegram import Update, constants, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
+from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler, TypeHandler
 from telegram.helpers import escape_markdown
-import requests
 import random
 import os
 import asyncio
 import html 
-from datetime import datetime
+import httpx
+from datetime import datetime, time as dtime, timezone
 import logging 
 import traceback
 import json
 import time 
 import tempfile 
-import psutil
 # --- Import Leaderboard Manager ---
 import leaderboard_manager 
+import http_client
+import quiz_bank
+import outbound
+import bot_state
+import spam_limiter
+import broadcast_jobs
+import db
+import message_ingest
+import partitions
+import ranking_index
+import metrics
+import image_cache
+import chat_cache
+import photo_cache
+import loop_watchdog
 
 # --- ⚙️ Constants and Setup ---
 # 10 MINUTE COOLDOWN (10 min * 60 sec)
 GLOBAL_QUIZ_COOLDOWN = 600 
+# How often the scheduler checks whether a quiz is due
+QUIZ_SCHEDULER_INTERVAL = int(os.environ.get('QUIZ_SCHEDULER_INTERVAL', '30'))
 
-LOCK_KEY = 'global_quiz_lock' 
 LAST_GLOBAL_QUIZ_KEY = 'last_global_quiz_time'
 LAST_QUIZ_MESSAGE_KEY = 'last_quiz_message_ids' 
+# Cooldown and last quiz message ids survive restarts
+bot_state.store.track(LAST_GLOBAL_QUIZ_KEY, LAST_QUIZ_MESSAGE_KEY)
 
 # --- 💡 VIDEO SOLUTION YAHAN HAI ---
 WELCOME_VIDEO_URLS = [
@@ -50,19 +67,15 @@ START_PHOTO_ID = os.environ.get('START_PHOTO_ID')
 ABOUT_PHOTO_ID = os.environ.get('ABOUT_PHOTO_ID') # Now unused in about_command, but kept for reference
 DONATION_PHOTO_ID = os.environ.get('DONATION_PHOTO_ID') # QR Code Photo ID
 DONATION_DETAILS = os.environ.get('DONATION_DETAILS', "UPI: example@upi / Wallet: 1234567890")
-# --- 💡 NEW SPAM CONSTANTS ---
-SPAM_MESSAGE_LIMIT = 5 
-SPAM_TIME_WINDOW = 2
-SPAM_BLOCK_DURATION = 600 
+# Spam limits (SPAM_MESSAGE_LIMIT / SPAM_TIME_WINDOW / SPAM_BLOCK_DURATION) live in spam_limiter.py
+
+# --- Update Concurrency ---
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '256'))
 
 # --- 💡 Naya: Initialize Bot Start Time ---
 BOT_START_TIME = datetime.now()
-try:
-    import psutil
-    logger.info("psutil imported successfully.")
-except ImportError:
-    psutil = None
-    logger.warning("psutil not installed. System metrics will be limited.")
+# Monotonic twin of BOT_START_TIME for cold start timing
+PROCESS_STARTED = time.perf_counter()
 
 # --- 💡 Naya: Uptime Helper Function ---
 def get_uptime_string():
@@ -109,28 +122,14 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
 
 # --- 🎯 COMMANDS ---
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    leaderboard_manager.setup_database() 
-    leaderboard_manager.register_chat(update) 
-    
-    bot = await context.bot.get_me()
-    bot_name = escape_markdown(bot.first_name, version=2)
-    user_name = escape_markdown(update.effective_user.first_name, version=2)
+_start_keyboard = None
 
-    start_text = (
-        f"👋 *Hi {user_name}, I'm {bot_name}*\\!\n\n"
-        f"I'm here to make this group fun with quizzes and rankings\\.\n\n"
-        f"**What I can do:**\n"
-        f"• 🏆 Track message rankings \\(/ranking\\)\n"
-        f"• 🧠 Run automatic quizzes as you chat\n"
-        f"• 👤 Check your stats with \\/profile\n"
-        f"• 🖼️ Find images with \\/img `[query]`\n"
-        f"• 🎨 Generate images with \\/gen `[prompt]`\n\n"
-        f"Just start chatting to activate the next quiz and climb the ranks\\!"
-    )
+def get_start_keyboard(bot_username: str) -> InlineKeyboardMarkup:
+    """The /start buttons never change for a given bot, so the markup is built once (during warm-up)."""
+    global _start_keyboard
+    if _start_keyboard is not None:
+        return _start_keyboard
 
-    bot_username = bot.username 
-    
     add_button = InlineKeyboardButton(
         "➕ Add Me to Your Group", 
         url=f"https://t.me/{bot_username}?startgroup=true"
@@ -145,10 +144,32 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         url="https://t.me/OrbitStudioOfficial" 
     )
     
-    keyboard = InlineKeyboardMarkup([
+    _start_keyboard = InlineKeyboardMarkup([
         [add_button],                                
         [support_channel_button, support_group_button] 
     ])
+    return _start_keyboard
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await leaderboard_manager.register_chat(update) 
+    
+    # Bot identity was fetched once by Application.initialize(); no get_me() round trip
+    bot_name = escape_markdown(context.bot.first_name, version=2)
+    user_name = escape_markdown(update.effective_user.first_name, version=2)
+
+    start_text = (
+        f"👋 *Hi {user_name}, I'm {bot_name}*\\!\n\n"
+        f"I'm here to make this group fun with quizzes and rankings\\.\n\n"
+        f"**What I can do:**\n"
+        f"• 🏆 Track message rankings \\(/ranking\\)\n"
+        f"• 🧠 Run automatic quizzes as you chat\n"
+        f"• 👤 Check your stats with \\/profile\n"
+        f"• 🖼️ Find images with \\/img `[query]`\n"
+        f"• 🎨 Generate images with \\/gen `[prompt]`\n\n"
+        f"Just start chatting to activate the next quiz and climb the ranks\\!"
+    )
+
+    keyboard = get_start_keyboard(context.bot.username)
     
     if START_PHOTO_ID:
         try:
@@ -178,7 +199,7 @@ async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not update.message.new_chat_members:
         return
 
-    leaderboard_manager.register_chat(update)
+    await leaderboard_manager.register_chat(update)
     chat_id = update.effective_chat.id
     chat_name = html.escape(update.effective_chat.title or "this chat")
 
@@ -228,8 +249,7 @@ async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
 
 async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    bot = await context.bot.get_me()
-    bot_name = escape_markdown(bot.first_name, version=2)
+    bot_name = escape_markdown(context.bot.first_name, version=2)
     
     about_text = (
         f"👋 *About Me*\n\n"
@@ -308,7 +328,7 @@ async def donation_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     donation_photo_id = DONATION_PHOTO_ID
     donation_details = DONATION_DETAILS
-    bot_name = escape_markdown((await context.bot.get_me()).first_name, version=2)
+    bot_name = escape_markdown(context.bot.first_name, version=2)
     
     donation_text = (
         f"🙏 *Support {bot_name}*\\!\n\n"
@@ -351,6 +371,11 @@ async def ping_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 3. Resource Usage (RAM/ROM)
     ram_usage = "N/A"
     try:
+        # Imported here: only /ping needs psutil, so it stays out of cold start
+        try:
+            import psutil
+        except ImportError:
+            psutil = None
         if psutil:
             process = psutil.Process(os.getpid())
             mem = process.memory_info()
@@ -362,16 +387,68 @@ async def ping_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         ram_usage = "Error fetching RAM"
     
-    # 4. Database Status (Assuming connection through leaderboard_manager)
-    db_status = "SQLite / PostgreSQL (via Leaderboard Manager)"
+    # 4. Database Status (Shared connection pool)
+    pool_stats = db.pool.stats()
+    if pool_stats['open']:
+        db_status = (
+            f"PostgreSQL pool {pool_stats['in_use']} in use / {pool_stats['idle']} idle "
+            f"(max {pool_stats['max_size']}), wait avg {pool_stats['wait_avg_ms']:.1f} ms / max {pool_stats['wait_max_ms']:.1f} ms"
+        )
+    else:
+        db_status = "PostgreSQL pool offline"
+
+    ingest_stats = message_ingest.ingestor.stats()
+    ingest_status = (
+        f"queue {ingest_stats['queue_depth']}, flush last {ingest_stats['last_flush_ms']:.1f} ms / "
+        f"avg {ingest_stats['avg_flush_ms']:.1f} ms / max {ingest_stats['max_flush_ms']:.1f} ms, dropped {ingest_stats['dropped']}"
+    )
+
+    asset_stats = leaderboard_manager.render_assets.stats()
+    asset_status = (
+        f"{asset_stats['fonts']} fonts, {asset_stats['backgrounds']} backgrounds, "
+        f"{(asset_stats['font_file_bytes'] + asset_stats['background_bytes']) / (1024 * 1024):.1f} MB"
+    )
+
+    dispatch_stats = outbound.dispatcher.stats()
+    dispatch_status = (
+        f"{dispatch_stats['calls']} calls, avg {dispatch_stats['avg_rate_per_sec']:.2f}/s, "
+        f"RetryAfter {dispatch_stats['retry_after_hits']}"
+    )
+    for job in outbound.dispatcher.jobs():
+        if job['running']:
+            dispatch_status += f"; {job['name']} {job['done']}/{job['total']} at {job['rate_per_sec']:.1f}/s"
+
+    ranking_stats = ranking_index.index.stats()
+    if ranking_stats['ready']:
+        ranking_status = (
+            f"{ranking_stats['boards']} boards for {ranking_stats['chats']} chats, built in {ranking_stats['rebuild_ms']:.0f} ms, "
+            f"{ranking_stats['queries']} queries, {ranking_stats['name_lookups']} name lookups"
+        )
+    else:
+        ranking_status = "not ready (SQL fallback)"
+
+    lag_stats = loop_watchdog.watchdog.stats()
+    if lag_stats['samples']:
+        p50, p99 = loop_watchdog.watchdog.lag_quantile(0.5), loop_watchdog.watchdog.lag_quantile(0.99)
+        loop_status = (
+            f"p50 ≤ {p50 * 1000:.0f} ms, p99 ≤ {p99 * 1000:.0f} ms, max {lag_stats['max_lag_ms']:.0f} ms, "
+            f"{lag_stats['stalls']} stalls over {lag_stats['threshold_ms']:.0f} ms"
+        )
+    else:
+        loop_status = "not sampled yet"
+
+    spam_stats = spam_limiter.limiter.stats()
+    spam_status = (
+        f"{spam_stats['tracked_users']} users tracked (~{spam_stats['approx_bytes'] / 1024:.0f} KB), "
+        f"{spam_stats['blocks']} blocks, {spam_stats['evicted']} idle evicted"
+    )
 
     # 5. Latency (End)
     end_time = time.time()
     latency_ms = (end_time - start_time) * 1000
     
     # 6. Format Final Message
-    bot_info = await context.bot.get_me()
-    bot_name = escape_markdown(bot_info.first_name, version=2)
+    bot_name = escape_markdown(context.bot.first_name, version=2)
     
     status_text = (
         f"✨ *Bot Status for {bot_name}* ✨\n\n"
@@ -383,7 +460,13 @@ async def ping_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"  • RAM Usage: `{ram_usage}`\n"
         f"  • Storage/ROM: `External (Render/DB)`\n\n" # Ye general info hai
         f"**📊 System Details**\n"
-        f"  • Database: `{db_status}`"
+        f"  • Database: `{escape_markdown(db_status, version=2, entity_type=constants.MessageEntityType.CODE)}`\n"
+        f"  • Ingestion: `{escape_markdown(ingest_status, version=2, entity_type=constants.MessageEntityType.CODE)}`\n"
+        f"  • Render Assets: `{escape_markdown(asset_status, version=2, entity_type=constants.MessageEntityType.CODE)}`\n"
+        f"  • Outbound: `{escape_markdown(dispatch_status, version=2, entity_type=constants.MessageEntityType.CODE)}`\n"
+        f"  • Ranking Index: `{escape_markdown(ranking_status, version=2, entity_type=constants.MessageEntityType.CODE)}`\n"
+        f"  • Spam Limiter: `{escape_markdown(spam_status, version=2, entity_type=constants.MessageEntityType.CODE)}`\n"
+        f"  • Loop Lag: `{escape_markdown(loop_status, version=2, entity_type=constants.MessageEntityType.CODE)}`"
     )
 
     # 7. Edit the initial message
@@ -400,10 +483,10 @@ async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Please provide a search term. Example: `/img nature`")
         return
     query = " ".join(context.args)
-    url = f"https://api.pexels.com/v1/search?query={query}&per_page=15"
+    url = "https://api.pexels.com/v1/search"
     headers = {"Authorization": PEXELS_API_KEY}
     try:
-        response = requests.get(url, headers=headers, timeout=5)
+        response = await http_client.client.get(url, params={"query": query, "per_page": 15}, headers=headers)
         response.raise_for_status()
         data = response.json()
         if not data.get('photos'):
@@ -417,9 +500,9 @@ async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             caption=caption,
             parse_mode=constants.ParseMode.MARKDOWN_V2
         )
-    except requests.Timeout:
+    except httpx.TimeoutException:
         await update.message.reply_text("The image search timed out. Please try again.")
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Pexels API error: {e}")
         await update.message.reply_text("Sorry, there was an error with the image search.")
 
@@ -436,7 +519,7 @@ async def gen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "prompt": prompt,
             "params": { "n": 1, "width": 512, "height": 512 }
         }
-        post_response = requests.post(post_url, json=payload, headers=headers, timeout=10)
+        post_response = await http_client.client.post(post_url, json=payload, headers=headers)
         post_response.raise_for_status()
         if 'id' not in post_response.json():
              raise Exception(f"API Error: {post_response.json().get('message', 'Unknown')}")
@@ -449,14 +532,14 @@ async def gen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await sent_msg.edit_text("Generation timed out. Please try again later.")
                 return
             check_url = f"https://stablehorde.net/api/v2/generate/check/{generation_id}"
-            check_response = requests.get(check_url, timeout=5)
+            check_response = await http_client.client.get(check_url)
             check_data = check_response.json()
             if check_data.get('faulted', False):
                 await sent_msg.edit_text("Generation failed. The prompt might be invalid or the service is busy.")
                 return
             if check_data.get('done', False):
                 status_url = f"https://stablehorde.net/api/v2/generate/status/{generation_id}"
-                status_response = requests.get(status_url, timeout=5)
+                status_response = await http_client.client.get(status_url)
                 status_data = status_response.json()
                 img_url = status_data['generations'][0]['img']
                 escaped_prompt = escape_markdown(prompt, version=2)
@@ -467,7 +550,7 @@ async def gen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     parse_mode=constants.ParseMode.MARKDOWN_V2
                 )
                 return
-    except requests.Timeout:
+    except httpx.TimeoutException:
         await sent_msg.edit_text("The generation service timed out. Please try again.")
     except Exception as e:
         logger.error(f"Stable Horde error: {e}")
@@ -480,7 +563,7 @@ async def chats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("This is an owner-only command\.")
         return
         
-    stats = leaderboard_manager.get_chat_stats()
+    stats = await leaderboard_manager.get_chat_stats()
     
     if stats is None:
         await update.message.reply_text("❌ Database connection error or failed to fetch chat statistics\.")
@@ -512,121 +595,89 @@ async def chats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- 📣 QUIZ LOGIC ---
 
-# 💡 FINAL MODIFIED: Options ko fetch karke shuffle karo, jisse har quiz ka order alag ho. 
-# Telegram ispar apni user-specific shuffling lagayega.
-async def fetch_multiple_quiz_data_from_api(amount: int = 10):
-    TRIVIA_API_URL = f"https://opentdb.com/api.php?amount={amount}&type=multiple"
-    try:
-        response = requests.get(TRIVIA_API_URL, timeout=8) 
-        response.raise_for_status() 
-        data = response.json()
-        if data['response_code'] != 0 or not data['results']:
-            logger.error(f"API returned error code or no results: {data.get('response_code')}")
-            return []
-            
-        quiz_list = []
-        for question_data in data['results']:
-            # Decode question and answers
-            question_text = html.unescape(requests.utils.unquote(question_data['question']))
-            correct_answer = html.unescape(requests.utils.unquote(question_data['correct_answer']))
-            incorrect_answers = [html.unescape(requests.utils.unquote(ans)) for ans in question_data['incorrect_answers']]
-            
-            all_options = incorrect_answers + [correct_answer]
-            random.shuffle(all_options) # 💡 Options shuffle kiya gaya (Code Level Shuffle)
-            
-            # Find the new index of the correct answer
-            try:
-                correct_option_id = all_options.index(correct_answer)
-            except ValueError:
-                correct_option_id = 0 
-                
-            explanation = f"Correct Answer: {correct_answer}" 
-            
-            quiz_list.append({
-                'question': question_text,
-                'options': all_options,
-                'correct_option_id': correct_option_id,
-                'explanation': explanation
-            })
-            
-        return quiz_list
-
-    except Exception as e:
-        logger.error(f"Error fetching multiple quiz data from API: {e}")
-        return []
-
 # --- 💡 MODIFIED: Global Broadcast Logic with Unique Quiz and Delay ---
 async def broadcast_quiz(context: ContextTypes.DEFAULT_TYPE):
     bot_data = context.bot_data
-    chat_ids = leaderboard_manager.get_all_active_chat_ids()
+    chat_ids = await leaderboard_manager.get_all_active_chat_ids()
     
     if not chat_ids:
         logger.warning("No active chats registered for broadcast.")
+        # Skipped attempts also restart the cooldown, so the scheduler does not retry every interval
+        await bot_state.store.set(bot_data, LAST_GLOBAL_QUIZ_KEY, datetime.now().timestamp())
         return
         
-    quiz_pool = await fetch_multiple_quiz_data_from_api(amount=10)
-    if not quiz_pool:
-        logger.error("Failed to fetch quiz data globally, cancelling broadcast.")
+    # One not-yet-seen question per chat, drawn from the prefetched bank (no API call here)
+    quiz_assignments = await quiz_bank.bank.draw_for_chats(chat_ids)
+    if not quiz_assignments:
+        logger.error("Quiz bank is empty, cancelling broadcast until the next cooldown.")
+        await bot_state.store.set(bot_data, LAST_GLOBAL_QUIZ_KEY, datetime.now().timestamp())
         return
         
     # --- 💡 STEP 1: DELETE OLD QUIZZES ---
     old_quiz_messages = bot_data.pop(LAST_QUIZ_MESSAGE_KEY, {}) 
     
-    delete_tasks = []
+    old_messages = []
     for chat_id_str, message_id in old_quiz_messages.items():
         try:
-            chat_id = int(chat_id_str)
-            # Suppress exception for deleted messages 
-            delete_tasks.append(
-                context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-            )
+            old_messages.append((int(chat_id_str), message_id))
         except ValueError:
             logger.warning(f"Invalid chat_id found in old quiz messages: {chat_id_str}")
         
-    if delete_tasks:
-        logger.info(f"Attempting to delete {len(delete_tasks)} old quiz messages.")
-        # Use asyncio.gather to run deletions concurrently and safely
-        await asyncio.gather(*delete_tasks, return_exceptions=True) 
+    if old_messages:
+        logger.info(f"Attempting to delete {len(old_messages)} old quiz messages.")
+        # Paced by the shared dispatcher; failures (already deleted etc.) are just counted
+        await outbound.dispatcher.run_bulk(
+            'quiz_delete',
+            old_messages,
+            lambda item: outbound.dispatcher.call(item[0], context.bot.delete_message, chat_id=item[0], message_id=item[1])
+        )
     
     # --- 💡 STEP 2: SEND NEW QUIZ WITH UNIQUE CONTENT AND DELAY ---
     new_quiz_messages = {}
+    delivered_questions = []
     successful_sends = 0
-    quiz_index = 0
-    num_quizzes = len(quiz_pool)
+    num_quizzes = len({quiz['question_id'] for quiz in quiz_assignments.values()})
     
     logger.info(f"Starting broadcast to {len(chat_ids)} chats using {num_quizzes} unique quizzes.")
 
-    for chat_id in chat_ids:
-        # Cycle through the available 10 quizzes 
-        quiz_data = quiz_pool[quiz_index % num_quizzes] 
-        
-        # Send quiz and track 
-        res = await send_quiz_and_track_id(context, chat_id, quiz_data)
-        
+    # Send quiz and track (pacing comes from the dispatcher's token buckets, not a fixed sleep)
+    # Chats that reject the quiz are deactivated in batches instead of one UPDATE each
+    deactivator = leaderboard_manager.ChatDeactivator()
+    results = await outbound.dispatcher.run_bulk(
+        'quiz_broadcast',
+        list(quiz_assignments.items()),
+        lambda item: send_quiz_and_track_id(context, item[0], item[1], deactivator),
+        is_success=lambda res: isinstance(res, tuple) and res[1] == "Success"
+    )
+    await deactivator.flush()
+
+    for (chat_id, quiz_data), res in zip(quiz_assignments.items(), results):
         if isinstance(res, tuple) and res[1] == "Success":
             successful_sends += 1
             # res is (chat_id, "Success", message_id)
             new_quiz_messages[str(chat_id)] = res[2] 
+            delivered_questions.append((chat_id, quiz_data['question_id']))
             
         elif isinstance(res, tuple) and res[1].startswith("Failed_Deactivated"):
             pass
         elif isinstance(res, Exception):
             logger.error(f"An unexpected error occurred during single send for {chat_id}: {res}")
-        
-        quiz_index += 1 
-        
-        # --- Implement 5-second delay between chat broadcasts ---
-        await asyncio.sleep(5)
             
-    bot_data[LAST_QUIZ_MESSAGE_KEY] = new_quiz_messages
-    bot_data[LAST_GLOBAL_QUIZ_KEY] = datetime.now().timestamp()
-    logger.info(f"Broadcast attempt finished. Successful to {successful_sends} / {len(chat_ids)} chats. Global timer reset. {len(new_quiz_messages)} new quiz IDs stored.")
+    await quiz_bank.bank.mark_seen(delivered_questions)
+    await bot_state.store.set(bot_data, LAST_QUIZ_MESSAGE_KEY, new_quiz_messages)
+    await bot_state.store.set(bot_data, LAST_GLOBAL_QUIZ_KEY, datetime.now().timestamp())
+    logger.info(
+        f"Broadcast attempt finished. Successful to {successful_sends} / {len(chat_ids)} chats, "
+        f"{deactivator.deactivated} chats deactivated. Global timer reset. {len(new_quiz_messages)} new quiz IDs stored."
+    )
 
 
 # --- 💡 IMPORTANT MODIFICATION: is_anonymous=False (Unchanged) ---
-async def send_quiz_and_track_id(context: ContextTypes.DEFAULT_TYPE, chat_id, quiz_data):
+async def send_quiz_and_track_id(context: ContextTypes.DEFAULT_TYPE, chat_id, quiz_data, deactivator):
     try:
-        sent_message = await context.bot.send_poll( 
+        sent_message = await outbound.dispatcher.call(
+            chat_id,
+            context.bot.send_poll,
             chat_id=chat_id,
             question=quiz_data['question'],
             options=quiz_data['options'],
@@ -640,7 +691,7 @@ async def send_quiz_and_track_id(context: ContextTypes.DEFAULT_TYPE, chat_id, qu
         return (chat_id, "Success", sent_message.message_id) 
     except (telegram.error.Forbidden, telegram.error.BadRequest) as e:
         logger.warning(f"Failed to send to {chat_id} (Forbidden/Bad Request): {e}. Deactivating chat.")
-        leaderboard_manager.deactivate_chat_in_db(chat_id)
+        await deactivator.add(chat_id)
         return (chat_id, f"Failed_Deactivated: {e}", None)
     except Exception as e:
         logger.error(f"Failed to send quiz to {chat_id} (Timeout/Other): {e}")
@@ -659,33 +710,16 @@ async def handle_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE
     if update.message.text and update.message.text.startswith('/'):
         return
 
-    chat_id = update.effective_chat.id
-    user_data = context.user_data
-    bot_data = context.bot_data
-
     # --- 1. Spam Protection Logic ---
+    # Kept in spam_limiter rather than user_data, which would hold every user ever seen
     current_time = time.time()
-    blocked_until = user_data.get('leaderboard_blocked_until', 0)
-    
-    if current_time < blocked_until:
+    spam_state = spam_limiter.limiter.check(update.effective_user.id, current_time)
+
+    if spam_state == spam_limiter.BLOCKED:
         logger.info(f"User {update.effective_user.id} message ignored (still blocked).")
         return 
         
-    if 'leaderboard_blocked_until' in user_data:
-         del user_data['leaderboard_blocked_until']
-         
-    message_timestamps = user_data.get('msg_timestamps', [])
-    if not isinstance(message_timestamps, list):
-         message_timestamps = []
-         
-    time_window_start = current_time - SPAM_TIME_WINDOW
-    recent_timestamps = [t for t in message_timestamps if t > time_window_start]
-    recent_timestamps.append(current_time)
-    user_data['msg_timestamps'] = recent_timestamps
-    
-    if len(recent_timestamps) >= SPAM_MESSAGE_LIMIT:
-        user_data['leaderboard_blocked_until'] = current_time + SPAM_BLOCK_DURATION
-        user_data['msg_timestamps'] = [] 
+    if spam_state == spam_limiter.JUST_BLOCKED:
         logger.warning(f"!!! SPAM IGNORE TRIGGERED !!! User {update.effective_user.id} ignored for 10 minutes.")
         
         try:
@@ -706,77 +740,232 @@ async def handle_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE
     # --- 2. Update DB (Leaderboard) ---
     await leaderboard_manager.update_message_count_db(update, context)
 
-    # --- 3. Check for Quiz (Global Logic) ---
-    last_quiz_time = bot_data.get(LAST_GLOBAL_QUIZ_KEY, 0)
-    
-    if current_time - last_quiz_time > GLOBAL_QUIZ_COOLDOWN:
-        
-        if bot_data.get(LOCK_KEY, False):
-            return
-        
+    # --- 3. Quiz activity (the broadcast itself runs in quiz_scheduler_job) ---
+    global _last_group_activity
+    _last_group_activity = current_time
+
+# --- ⏰ QUIZ SCHEDULER ---
+# Time of the last counted group message; a quiz only goes out if someone chatted since the previous one
+_last_group_activity = 0.0
+_quiz_broadcast_lock = asyncio.Lock()
+
+async def run_quiz_broadcast(context: ContextTypes.DEFAULT_TYPE):
+    async with _quiz_broadcast_lock:
         try:
-            bot_data[LOCK_KEY] = True
-            logger.info(f"Global quiz cooldown over. Triggered by user {update.effective_user.id} in chat {chat_id}. Broadcasting to all.")
-            await broadcast_quiz(context) 
-            
+            await broadcast_quiz(context)
         except Exception as e:
-            logger.error(f"Error during global quiz broadcast trigger: {e}")
-        finally:
-            bot_data[LOCK_KEY] = False
-    else:
-        pass
+            logger.error(f"Error during global quiz broadcast: {e}")
+            # Back off for a full cooldown rather than failing again on the next scheduler tick
+            await bot_state.store.set(context.bot_data, LAST_GLOBAL_QUIZ_KEY, time.time())
+
+async def quiz_scheduler_job(context: ContextTypes.DEFAULT_TYPE):
+    """Repeating job: starts a global quiz once the cooldown is over and groups have been active since the last one."""
+    # Until the persisted cooldown is loaded, a fresh process would see it as expired
+    if not bot_state.store.ready.is_set() or _quiz_broadcast_lock.locked():
+        return
+    last_quiz_time = context.bot_data.get(LAST_GLOBAL_QUIZ_KEY, 0)
+    if time.time() - last_quiz_time <= GLOBAL_QUIZ_COOLDOWN or _last_group_activity <= last_quiz_time:
+        return
+    logger.info("Global quiz cooldown over and groups are active. Broadcasting to all.")
+    # Runs as its own task so this job returns at once; the lock keeps broadcasts from overlapping
+    context.application.create_task(run_quiz_broadcast(context))
             
+# --- ⏱️ Cold Start Timing ---
+_first_update_at = None
+_first_response_logged = False
+
+_UPDATE_TYPES = ('message', 'callback_query', 'edited_message', 'my_chat_member', 'chat_member', 'poll_answer', 'poll')
+
+async def mark_update_received(update: object, context: ContextTypes.DEFAULT_TYPE):
+    global _first_update_at
+    metrics.updates.inc(next((kind for kind in _UPDATE_TYPES if getattr(update, kind, None)), 'other'))
+    if _first_update_at is None:
+        _first_update_at = time.perf_counter()
+        logger.info(f"First update received {_first_update_at - PROCESS_STARTED:.2f} s after process start.")
+
+async def mark_update_handled(update: object, context: ContextTypes.DEFAULT_TYPE):
+    # Registered in the last group, so it runs after the real handlers for the update finished
+    global _first_response_logged
+    if not _first_response_logged and _first_update_at is not None:
+        _first_response_logged = True
+        now = time.perf_counter()
+        logger.info(
+            f"Time to first response: {now - PROCESS_STARTED:.2f} s after process start "
+            f"({(now - _first_update_at) * 1000:.0f} ms handling the first update)."
+        )
+
+# --- 📈 Metrics Sources ---
+def _broadcast_metrics():
+    jobs = broadcast_jobs.runner.progress()
+    bulk = outbound.dispatcher.jobs()
+    return [
+        ('bot_broadcast_position', 'Targets checkpointed by a running owner broadcast', [({'job': job_id}, position) for job_id, position, _, _ in jobs]),
+        ('bot_broadcast_targets', 'Targets of a running owner broadcast', [({'job': job_id}, total) for job_id, _, total, _ in jobs]),
+        ('bot_broadcast_rate', 'Chats per second sent by a running owner broadcast', [({'job': job_id}, rate) for job_id, _, _, rate in jobs]),
+        ('bot_bulk_job_done', 'Items processed by the latest run of each bulk send', [({'job': job['name']}, job['done']) for job in bulk]),
+        ('bot_bulk_job_total', 'Items in the latest run of each bulk send', [({'job': job['name']}, job['total']) for job in bulk]),
+        ('bot_bulk_job_failed', 'Failed items in the latest run of each bulk send', [({'job': job['name']}, job['failed']) for job in bulk]),
+    ]
+
+def register_metrics():
+    # Read from the existing stats() methods at scrape time; hit/miss counters give the cache hit rates
+    for prefix, stats_fn in (
+        ('db_pool', db.pool.stats),
+        ('ingest', message_ingest.ingestor.stats),
+        ('image_cache', image_cache.cache.stats),
+        ('chat_cache', chat_cache.cache.stats),
+        ('photo_cache', photo_cache.cache.stats),
+        ('render_pool', leaderboard_manager.render_pool.stats),
+        ('outbound', outbound.dispatcher.stats),
+        ('http_client', http_client.client.stats),
+        ('ranking_index', ranking_index.index.stats),
+        ('spam_limiter', spam_limiter.limiter.stats),
+        ('quiz_bank', quiz_bank.bank.stats),
+        ('partitions', partitions.manager.stats),
+        ('loop', loop_watchdog.watchdog.stats),
+    ):
+        metrics.registry.add_stats(prefix, stats_fn)
+    metrics.registry.add_collector(_broadcast_metrics)
+
+# --- 🔌 Application Lifecycle ---
+_warm_up_task = None
+_ranking_rebuild_task = None
+
+async def warm_up(application: Application):
+    """
+    Everything slow at startup runs here, after the webhook is already listening.
+    Handlers that need the DB wait for it through db.pool.wait_ready().
+    """
+    global _ranking_rebuild_task
+    started = time.perf_counter()
+    # Identity comes from the get_me() done by Application.initialize()
+    get_start_keyboard(application.bot.username)
+    try:
+        # The pool is created once here and shared by every handler for the bot's lifetime
+        if await db.pool.open():
+            await leaderboard_manager.setup_database()
+            # This month's partition must exist before ingestion writes, or rows land in messages_default
+            await partitions.manager.ensure_upcoming()
+            application.job_queue.run_repeating(
+                partitions.manager.maintenance_job, interval=partitions.PARTITION_MAINTENANCE_INTERVAL,
+                first=partitions.PARTITION_MAINTENANCE_INTERVAL, name='partition_maintenance'
+            )
+            application.job_queue.run_repeating(
+                partitions.manager.legacy_move_job, interval=partitions.LEGACY_MOVE_INTERVAL, first=30, name='legacy_messages_move'
+            )
+            # Raw rows past the retention horizon are dropped; alltime counts come from user_chat_totals
+            application.job_queue.run_repeating(
+                partitions.manager.compact_job, interval=partitions.RETENTION_INTERVAL, first=300, name='message_retention'
+            )
+            # Starts flushing the events queued while the pool was opening
+            message_ingest.ingestor.start()
+            # Leaderboards are served from memory once this finishes; until then they use SQL
+            _ranking_rebuild_task = asyncio.create_task(ranking_index.index.rebuild())
+            application.job_queue.run_daily(
+                ranking_index.index.roll_over_job, time=dtime(0, 0, 5, tzinfo=timezone.utc), name='ranking_rollover'
+            )
+            # Owner broadcasts interrupted by a restart continue from their last checkpoint
+            await broadcast_jobs.runner.resume_all(application.bot)
+    except Exception as e:
+        logger.error(f"Database warm-up failed: {e}")
+    finally:
+        db.pool.mark_startup_done()
+    # Restore the quiz cooldown and old quiz ids; the quiz trigger waits for it
+    await bot_state.store.load(application.bot_data)
+    # Fonts and the pre-scaled backgrounds are loaded once, off the event loop
+    await asyncio.to_thread(leaderboard_manager.render_assets.warm)
+    logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f} s ({time.perf_counter() - PROCESS_STARTED:.2f} s since process start).")
+
+async def post_init(application: Application):
+    # Kept cheap on purpose: the webhook only starts listening after this returns
+    leaderboard_manager.render_pool.start()
+    await metrics.server.start()
+    # Logs the call site whenever something blocks the event loop
+    loop_watchdog.watchdog.start()
+    await http_client.client.start()
+    # Keep the quiz bank topped up in the background; broadcasts only read from it
+    application.job_queue.run_repeating(
+        quiz_bank.bank.refill_job, interval=quiz_bank.QUIZ_BANK_REFILL_INTERVAL, first=10, name='quiz_bank_refill'
+    )
+    application.job_queue.run_repeating(
+        quiz_scheduler_job, interval=QUIZ_SCHEDULER_INTERVAL, first=QUIZ_SCHEDULER_INTERVAL, name='quiz_scheduler'
+    )
+    # Keep a reference so the task is not garbage collected while it runs
+    global _warm_up_task
+    _warm_up_task = asyncio.create_task(warm_up(application))
+
+async def post_shutdown(application: Application):
+    # Flush buffered message events while the pool is still open
+    await message_ingest.ingestor.stop()
+    await db.pool.close()
+    leaderboard_manager.render_pool.shutdown()
+    await http_client.client.close()
+    await metrics.server.stop()
+    await loop_watchdog.watchdog.stop()
+
 # --- 🚀 MAIN EXECUTION FUNCTION ---
 def main(): 
     if not TOKEN or not WEBHOOK_URL:
         logger.critical("FATAL ERROR: Environment variables missing (TOKEN or WEBHOOK_URL).")
         return
-        
-    leaderboard_manager.setup_database()
 
     application = (
         Application.builder()
         .token(TOKEN)
-        .concurrent_updates(True)
-        .connect_timeout(10)   
-        .read_timeout(15)      
-        .write_timeout(15)     
-        .http_version('1.1')
+        .concurrent_updates(CONCURRENT_UPDATES)
+        # Same settings the builder used to apply, on a request backend that records Bot API metrics
+        .request(outbound.InstrumentedRequest(
+            # One HTTP connection per concurrently handled update plus one per bulk-send worker
+            connection_pool_size=CONCURRENT_UPDATES + outbound.DISPATCH_CONCURRENCY,
+            pool_timeout=10,
+            connect_timeout=10,
+            read_timeout=15,
+            write_timeout=15,
+            http_version='1.1',
+        ))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
     
     application.add_error_handler(error_handler)
+    register_metrics()
+
+    # Cold start timing: first and last handler groups see every update
+    application.add_handler(TypeHandler(Update, mark_update_received), group=-100)
+    application.add_handler(TypeHandler(Update, mark_update_handled), group=100)
     
     # Standard Commands
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("about", about_command))
-    application.add_handler(CommandHandler("broadcast", leaderboard_manager.broadcast_command))
+    application.add_handler(CommandHandler("start", metrics.timed(start_command)))
+    application.add_handler(CommandHandler("about", metrics.timed(about_command)))
+    application.add_handler(CommandHandler("broadcast", metrics.timed(broadcast_jobs.broadcast_command)))
+    application.add_handler(CommandHandler("broadcast_status", metrics.timed(broadcast_jobs.broadcast_status_command)))
 
     # NEW OWNER COMMAND
-    application.add_handler(CommandHandler("chats", chats_command))
+    application.add_handler(CommandHandler("chats", metrics.timed(chats_command)))
 
     # Leaderboard Commands
-    application.add_handler(CommandHandler("ranking", leaderboard_manager.ranking_command))
-    application.add_handler(CommandHandler("profile", leaderboard_manager.profile_command))
-    application.add_handler(CommandHandler("prof", leaderboard_manager.profile_command))
-    application.add_handler(CallbackQueryHandler(leaderboard_manager.leaderboard_callback, pattern='^lb_'))
+    application.add_handler(CommandHandler("ranking", metrics.timed(leaderboard_manager.ranking_command)))
+    application.add_handler(CommandHandler("profile", metrics.timed(leaderboard_manager.profile_command)))
+    application.add_handler(CommandHandler("prof", metrics.timed(leaderboard_manager.profile_command)))
+    application.add_handler(CallbackQueryHandler(metrics.timed(leaderboard_manager.leaderboard_callback), pattern='^lb_'))
     
     # Image Commands
-    application.add_handler(CommandHandler("img", img_command))
-    application.add_handler(CommandHandler("gen", gen_command))
-    application.add_handler(CommandHandler("donation", donation_command))
-    application.add_handler(CommandHandler("ping", ping_command))
+    application.add_handler(CommandHandler("img", metrics.timed(img_command)))
+    application.add_handler(CommandHandler("gen", metrics.timed(gen_command)))
+    application.add_handler(CommandHandler("donation", metrics.timed(donation_command)))
+    application.add_handler(CommandHandler("ping", metrics.timed(ping_command)))
     # ID Finder
-    application.add_handler(CommandHandler("get_id", get_id_command))
+    application.add_handler(CommandHandler("get_id", metrics.timed(get_id_command)))
 
     # Message Handlers
-    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome_new_member))
+    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, metrics.timed(welcome_new_member)))
     
     # Main Message Handler
     application.add_handler(
         MessageHandler(
             ~filters.COMMAND & filters.ChatType.GROUPS, 
-            handle_all_messages 
+            metrics.timed(handle_all_messages)
         )
     )
     
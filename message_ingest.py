@@ -0,0 +1,279 @@
+# message_ingest.py (Write-behind batching for message counting)
+
+import os
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+from psycopg2.extras import execute_values
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# --- ⚙️ Ingestion Configuration ---
+INGEST_QUEUE_MAX = int(os.environ.get('INGEST_QUEUE_MAX', '20000'))
+INGEST_FLUSH_INTERVAL_MS = int(os.environ.get('INGEST_FLUSH_INTERVAL_MS', '1000'))
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '500'))
+# Last persisted display name per user; a hit means no users upsert is needed
+USER_NAME_CACHE_SIZE = int(os.environ.get('USER_NAME_CACHE_SIZE', '50000'))
+
+
+def daily_counts_of(rows) -> Counter:
+    # Pre-aggregate a batch so the rollup gets one upsert per (chat, user, day)
+    return Counter(
+        (chat_id, user_id, message_time.astimezone(timezone.utc).date())
+        for chat_id, user_id, _, message_time in rows
+    )
+
+def _write_batch(conn, rows, changed_names, daily_counts):
+    user_chat_counts = Counter()
+    for (chat_id, user_id, _), count in daily_counts.items():
+        user_chat_counts[(user_id, chat_id)] += count
+    with conn.cursor() as cur:
+        # Display names live in the users table, not on every message row
+        execute_values(
+            cur,
+            "INSERT INTO messages (chat_id, user_id, message_time) VALUES %s;",
+            [(chat_id, user_id, message_time) for chat_id, user_id, _, message_time in rows],
+            page_size=len(rows)
+        )
+        if changed_names:
+            execute_values(
+                cur,
+                """
+                INSERT INTO users (user_id, display_name, updated_at) VALUES %s
+                ON CONFLICT (user_id) DO UPDATE
+                SET display_name = EXCLUDED.display_name, updated_at = EXCLUDED.updated_at
+                WHERE users.display_name IS DISTINCT FROM EXCLUDED.display_name;
+                """,
+                sorted(changed_names.items()),
+                template="(%s, %s, NOW())",
+                page_size=len(changed_names)
+            )
+        execute_values(
+            cur,
+            """
+            INSERT INTO message_counts_daily (chat_id, user_id, day, message_count) VALUES %s
+            ON CONFLICT (chat_id, user_id, day) DO UPDATE
+            SET message_count = message_counts_daily.message_count + EXCLUDED.message_count;
+            """,
+            [(chat_id, user_id, day, count) for (chat_id, user_id, day), count in sorted(daily_counts.items())],
+            page_size=len(daily_counts)
+        )
+        # All-time totals for /profile, kept in the same transaction as the rollup
+        execute_values(
+            cur,
+            """
+            INSERT INTO user_chat_totals (user_id, chat_id, message_count) VALUES %s
+            ON CONFLICT (user_id, chat_id) DO UPDATE
+            SET message_count = user_chat_totals.message_count + EXCLUDED.message_count;
+            """,
+            [(user_id, chat_id, count) for (user_id, chat_id), count in sorted(user_chat_counts.items())],
+            page_size=len(user_chat_counts)
+        )
+
+
+_STOP = object()
+
+
+class _Barrier:
+    """Queued callable the flusher runs after flushing everything queued before it."""
+
+    def __init__(self, fn, future):
+        self.fn = fn
+        self.future = future
+
+    async def run(self):
+        # The waiter may have been cancelled meanwhile; setting its result then would kill the flusher
+        try:
+            result = await self.fn()
+        except Exception as e:
+            if not self.future.done():
+                self.future.set_exception(e)
+            return
+        if not self.future.done():
+            self.future.set_result(result)
+
+
+class MessageIngestor:
+    """
+    Buffers message events in a bounded queue and writes them with one
+    multi-row INSERT every INGEST_FLUSH_INTERVAL_MS or INGEST_BATCH_SIZE rows.
+    """
+
+    def __init__(self, max_queue: int, flush_interval_ms: int, batch_size: int):
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self._queue = None
+        self._task = None
+        self._stopped = False
+        self._known_names = OrderedDict()
+        # Called with the daily_counts Counter of every batch that reached the DB
+        self._flush_listeners = []
+        # Stats
+        self._enqueued = 0
+        self._dropped = 0
+        self._flushes = 0
+        self._rows_written = 0
+        self._rows_failed = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self):
+        if self._task:
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Message ingestion started (batch={self.batch_size}, interval={self.flush_interval * 1000:.0f} ms).")
+
+    def submit(self, chat_id: int, user_id: int, display_name: str, message_time: datetime = None) -> bool:
+        """Queues one message event. Returns False if the event was dropped."""
+        if self._stopped:
+            return False
+        if self._queue is None:
+            # Events that arrive while startup is still opening the DB wait here until start()
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        try:
+            self._queue.put_nowait((chat_id, user_id, display_name, message_time or datetime.now(timezone.utc)))
+        except asyncio.QueueFull:
+            self._dropped += 1
+            if self._dropped % 1000 == 1:
+                logger.warning(f"Message ingestion queue full ({self.max_queue}). Dropped {self._dropped} events so far.")
+            return False
+        self._enqueued += 1
+        return True
+
+    def add_flush_listener(self, listener):
+        self._flush_listeners.append(listener)
+
+    async def run_between_flushes(self, fn):
+        """
+        Awaits fn() at a point where every event submitted so far has been written
+        and no flush is in progress, e.g. to snapshot tables the flusher updates.
+        """
+        if not self._task:
+            return await fn()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Barrier(fn, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await self._queue.get()
+            if event is _STOP:
+                return
+            if isinstance(event, _Barrier):
+                await event.run()
+                continue
+            batch = [event]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            barrier = None
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is _STOP:
+                    stopping = True
+                    break
+                if isinstance(event, _Barrier):
+                    barrier = event
+                    break
+                batch.append(event)
+            await self._flush(batch)
+            if barrier:
+                await barrier.run()
+            if stopping:
+                return
+
+    def known_name(self, user_id: int):
+        return self._known_names.get(user_id)
+
+    def remember_names(self, names: dict):
+        """Records names known to match the users table."""
+        for user_id, display_name in names.items():
+            self._known_names[user_id] = display_name
+            self._known_names.move_to_end(user_id)
+        while len(self._known_names) > USER_NAME_CACHE_SIZE:
+            self._known_names.popitem(last=False)
+
+    def _drain(self) -> list:
+        batch = []
+        while not self._queue.empty():
+            event = self._queue.get_nowait()
+            if isinstance(event, _Barrier):
+                event.future.cancel()
+                continue
+            batch.append(event)
+        return batch
+
+    async def _flush(self, batch: list):
+        if not batch:
+            return
+        changed_names = {}
+        for _, user_id, display_name, _ in batch:
+            if self._known_names.get(user_id) != display_name:
+                changed_names[user_id] = display_name
+
+        daily_counts = daily_counts_of(batch)
+        started = time.perf_counter()
+        try:
+            await db.pool.run(_write_batch, batch, changed_names, daily_counts)
+            self._rows_written += len(batch)
+            self.remember_names(changed_names)
+        except Exception as e:
+            self._rows_failed += len(batch)
+            logger.error(f"Failed to flush {len(batch)} message events to DB: {e}")
+        else:
+            for listener in self._flush_listeners:
+                try:
+                    listener(daily_counts)
+                except Exception as e:
+                    logger.error(f"Flush listener failed: {e}")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._flushes += 1
+        self._last_flush_ms = elapsed_ms
+        self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+    async def stop(self):
+        """Stops the flusher and writes out everything still buffered."""
+        self._stopped = True
+        if not self._task:
+            return
+        # The sentinel lets the flusher finish the batch it is holding instead of losing it to a cancel
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        remaining = self._drain()
+        for i in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[i:i + self.batch_size])
+        self._queue = None
+        logger.info(f"Message ingestion stopped. Flushed {len(remaining)} late events on shutdown.")
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'enqueued': self._enqueued,
+            'dropped': self._dropped,
+            'flushes': self._flushes,
+            'rows_written': self._rows_written,
+            'rows_failed': self._rows_failed,
+            'last_flush_ms': self._last_flush_ms,
+            'max_flush_ms': self._max_flush_ms,
+            'avg_flush_ms': (self._total_flush_ms / self._flushes) if self._flushes else 0.0,
+        }
+
+
+ingestor = MessageIngestor(INGEST_QUEUE_MAX, INGEST_FLUSH_INTERVAL_MS, INGEST_BATCH_SIZE)
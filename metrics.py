@@ -0,0 +1,222 @@
+# metrics.py (Prometheus text-format metrics and a small /metrics HTTP server)
+
+import os
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# --- ⚙️ Metrics Configuration ---
+# Served on its own port next to the webhook listener; 0 disables the endpoint
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9090'))
+# Loopback by default: the stats are unauthenticated; set 0.0.0.0 to let an external scraper in
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+# Seconds; covers a cache hit (~1 ms) up to a slow render or Bot API call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    """Monotonic count per label combination. inc() is a dict update, cheap enough for every update."""
+
+    __slots__ = ('name', 'help', 'labelnames', '_values')
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram per label combination: one bisect and three additions per observation."""
+
+    __slots__ = ('name', 'help', 'labelnames', 'buckets', '_series')
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def snapshot(self, *labels):
+        """(bucket bounds, per-bucket counts with +Inf last, sum, count) for one label combination."""
+        counts, total, count = self._series.get(labels, ([0] * (len(self.buckets) + 1), 0.0, 0))
+        return self.buckets, list(counts), total, count
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        # (prefix, fn) pairs read only at scrape time, so the hot paths pay nothing for them
+        self._stats_sources = []
+        self._collectors = []
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_stats(self, prefix: str, stats_fn):
+        """Exposes every numeric field of stats_fn() (the modules' existing stats() dicts) as bot_<prefix>_<field>."""
+        self._stats_sources.append((prefix, stats_fn))
+
+    def add_collector(self, fn):
+        """fn() returns [(name, help, [(labels dict, value)])], rendered as gauges at scrape time."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats_fn in self._stats_sources:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logger.warning(f"Metrics source '{prefix}' failed: {e}")
+                continue
+            for key, value in stats.items():
+                # bool is an int subclass, so flags like 'open' or 'ready' come out as 0/1
+                if isinstance(value, (int, float)):
+                    name = f"bot_{prefix}_{key}"
+                    lines.extend((f"# TYPE {name} gauge", f"{name} {float(value)}"))
+        for fn in self._collectors:
+            try:
+                families = fn()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, help, samples in families:
+                lines.extend((f"# HELP {name} {help}", f"# TYPE {name} gauge"))
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {float(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# --- 📈 Shared Metrics ---
+updates = registry.counter('bot_updates_total', 'Updates received, by update type', ('type',))
+handler_seconds = registry.histogram('bot_handler_seconds', 'Handler run time', ('handler',))
+handler_errors = registry.counter('bot_handler_errors_total', 'Handlers that raised', ('handler',))
+db_query_seconds = registry.histogram('bot_db_query_seconds', 'Time to run a pooled DB call, excluding the pool wait', ('query',))
+db_query_errors = registry.counter('bot_db_query_errors_total', 'Pooled DB calls that raised', ('query',))
+render_seconds = registry.histogram('bot_render_seconds', 'generate_leaderboard_image time, including the render pool queue', ('pool',))
+api_request_seconds = registry.histogram('bot_api_request_seconds', 'Bot API request time', ('method',))
+api_requests = registry.counter('bot_api_requests_total', 'Bot API requests by method and HTTP status (or network_error)', ('method', 'status'))
+
+
+def timed(handler):
+    """Wraps a PTB callback so its run time and failures land in the handler metrics."""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+# --- 🌐 /metrics Server ---
+class MetricsServer:
+    """Minimal HTTP/1.0 server: GET /metrics returns the registry, anything else 404."""
+
+    def __init__(self, registry: Registry):
+        self.registry = registry
+        self._server = None
+        self.scrapes = 0
+
+    async def start(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        if self._server or not port:
+            return
+        try:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        except OSError as e:
+            logger.error(f"Metrics endpoint could not bind {host}:{port}: {e}")
+            return
+        logger.info(f"Metrics endpoint listening on {host}:{port}/metrics.")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Headers are read and ignored
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?', 1)[0] == '/metrics':
+                self.scrapes += 1
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+server = MetricsServer(registry)
@@ -0,0 +1,219 @@
+# migrations.py (Versioned schema migrations, applied once at boot)
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary constant key so two instances booting at once apply migrations one at a time
+MIGRATION_LOCK_ID = 726354001
+
+# --- 📜 Migrations ---
+# (version, description, [statements]). Append only: never edit a released entry.
+# Steps are written to be safe on databases created by the old setup_database(),
+# which has no schema_migrations rows but may already have some of these objects.
+MIGRATIONS = [
+    (1, "Base messages and chats tables", [
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            username VARCHAR(255),
+            message_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id BIGINT PRIMARY KEY,
+            chat_name VARCHAR(255),
+            chat_type VARCHAR(50),
+            last_activity TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE NOT NULL,
+            quiz_message_count INT DEFAULT 0 NOT NULL
+        );
+        """,
+        "ALTER TABLE chats ADD COLUMN IF NOT EXISTS chat_type VARCHAR(50);",
+        "ALTER TABLE chats ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE NOT NULL;",
+        "ALTER TABLE chats ADD COLUMN IF NOT EXISTS quiz_message_count INT DEFAULT 0 NOT NULL;",
+    ]),
+    (2, "Per chat/user/day message count rollup", [
+        """
+        CREATE TABLE IF NOT EXISTS message_counts_daily (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            day DATE NOT NULL,
+            message_count INT DEFAULT 0 NOT NULL,
+            PRIMARY KEY (chat_id, user_id, day)
+        );
+        """,
+        # Backfill only when empty, so a rollup already kept by ingestion is not double counted
+        """
+        INSERT INTO message_counts_daily (chat_id, user_id, day, message_count)
+        SELECT chat_id, user_id, (message_time AT TIME ZONE 'UTC')::date, COUNT(*)
+        FROM messages
+        WHERE NOT EXISTS (SELECT 1 FROM message_counts_daily)
+        GROUP BY chat_id, user_id, (message_time AT TIME ZONE 'UTC')::date;
+        """,
+    ]),
+    (3, "Users table with latest display name", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            display_name VARCHAR(255),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        INSERT INTO users (user_id, display_name, updated_at)
+        SELECT DISTINCT ON (user_id) user_id, username, message_time
+        FROM messages
+        WHERE username IS NOT NULL
+        ORDER BY user_id, message_time DESC
+        ON CONFLICT (user_id) DO NOTHING;
+        """,
+    ]),
+    (4, "Hot-path indexes for leaderboard, profile and broadcast queries", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_chat_time ON messages (chat_id, message_time);",
+        "CREATE INDEX IF NOT EXISTS idx_messages_user_chat ON messages (user_id, chat_id);",
+        "CREATE INDEX IF NOT EXISTS idx_chats_is_active ON chats (is_active);",
+    ]),
+    (5, "Quiz question bank and per-chat seen questions", [
+        """
+        CREATE TABLE IF NOT EXISTS quiz_questions (
+            id BIGSERIAL PRIMARY KEY,
+            question_hash CHAR(64) NOT NULL UNIQUE,
+            question TEXT NOT NULL,
+            correct_answer TEXT NOT NULL,
+            incorrect_answers JSONB NOT NULL,
+            times_used INT DEFAULT 0 NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_quiz_questions_usage ON quiz_questions (times_used, id);",
+        """
+        CREATE TABLE IF NOT EXISTS quiz_seen (
+            chat_id BIGINT NOT NULL,
+            question_id BIGINT NOT NULL REFERENCES quiz_questions (id) ON DELETE CASCADE,
+            seen_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, question_id)
+        );
+        """,
+    ]),
+    (6, "Persistent owner broadcast jobs with snapshotted targets", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            from_chat_id BIGINT NOT NULL,
+            message_id BIGINT NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            total INT DEFAULT 0 NOT NULL,
+            position INT DEFAULT 0 NOT NULL,
+            succeeded INT DEFAULT 0 NOT NULL,
+            failed INT DEFAULT 0 NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP WITH TIME ZONE
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status);",
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_targets (
+            job_id BIGINT NOT NULL REFERENCES broadcast_jobs (id) ON DELETE CASCADE,
+            seq INT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            PRIMARY KEY (job_id, seq)
+        );
+        """,
+    ]),
+    (7, "Persisted bot_data keys", [
+        """
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value JSONB NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+    (8, "Deactivated chat count on broadcast jobs", [
+        "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS deactivated INT DEFAULT 0 NOT NULL;",
+    ]),
+    # Only swaps tables, so it is instant on any size. Old rows stay readable in messages_legacy
+    # and are moved into monthly partitions in the background by partitions.legacy_move_job.
+    (9, "Monthly range-partitioned messages table", [
+        "ALTER TABLE messages RENAME TO messages_legacy;",
+        """
+        CREATE TABLE messages (
+            id BIGINT NOT NULL DEFAULT nextval('messages_id_seq'),
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            username VARCHAR(255),
+            message_time TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, message_time)
+        ) PARTITION BY RANGE (message_time);
+        """,
+        # The sequence must outlive messages_legacy, which is dropped once emptied
+        "ALTER SEQUENCE messages_id_seq OWNED BY messages.id;",
+        "CREATE TABLE messages_default PARTITION OF messages DEFAULT;",
+        "CREATE INDEX idx_messages_part_chat_time ON messages (chat_id, message_time);",
+        "CREATE INDEX idx_messages_part_user_chat ON messages (user_id, chat_id);",
+    ]),
+    (10, "All-time per user/chat message totals for /profile", [
+        """
+        CREATE TABLE IF NOT EXISTS user_chat_totals (
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            message_count BIGINT DEFAULT 0 NOT NULL,
+            PRIMARY KEY (user_id, chat_id)
+        );
+        """,
+        # The daily rollup already covers every message, including rows still in messages_legacy
+        """
+        INSERT INTO user_chat_totals (user_id, chat_id, message_count)
+        SELECT user_id, chat_id, SUM(message_count)
+        FROM message_counts_daily
+        WHERE NOT EXISTS (SELECT 1 FROM user_chat_totals)
+        GROUP BY user_id, chat_id;
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def run_migrations(conn) -> int:
+    """
+    Applies every pending migration, each in its own transaction, and
+    records it in schema_migrations. Returns the schema version afterwards.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+        conn.commit()
+        try:
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations;")
+            current = cur.fetchone()[0]
+            conn.commit()
+
+            for version, description, statements in MIGRATIONS:
+                if version <= current:
+                    continue
+                logger.info(f"Applying schema migration {version}: {description}")
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                    (version, description)
+                )
+                conn.commit()
+                current = version
+            return current
+        finally:
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+            conn.commit()
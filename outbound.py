@@ -0,0 +1,214 @@
+# outbound.py (Rate-limited outbound Telegram dispatcher shared by every bulk send)
+
+import os
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import telegram.error
+from telegram.request import HTTPXRequest
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- ⚙️ Dispatcher Configuration ---
+# Telegram allows ~30 messages/second overall; stay a little under it
+DISPATCH_GLOBAL_RATE = float(os.environ.get('DISPATCH_GLOBAL_RATE', '25'))
+DISPATCH_GLOBAL_BURST = int(os.environ.get('DISPATCH_GLOBAL_BURST', '25'))
+# Per chat: groups ~20 messages/minute, private chats ~1 message/second
+DISPATCH_GROUP_RATE_PER_MINUTE = float(os.environ.get('DISPATCH_GROUP_RATE_PER_MINUTE', '20'))
+DISPATCH_PRIVATE_RATE = float(os.environ.get('DISPATCH_PRIVATE_RATE', '1'))
+# Requests in flight for one bulk job; the token buckets set the actual pace
+DISPATCH_CONCURRENCY = int(os.environ.get('DISPATCH_CONCURRENCY', '16'))
+DISPATCH_MAX_RETRIES = int(os.environ.get('DISPATCH_MAX_RETRIES', '3'))
+# Idle per-chat buckets are dropped once there are more than this many
+DISPATCH_MAX_CHAT_BUCKETS = int(os.environ.get('DISPATCH_MAX_CHAT_BUCKETS', '5000'))
+# Finished bulk jobs kept for /ping and /metrics; running ones are always kept
+DISPATCH_FINISHED_JOBS_KEPT = int(os.environ.get('DISPATCH_FINISHED_JOBS_KEPT', '10'))
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        """Takes one token (possibly going into debt) and returns how long to wait for it."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class BulkProgress:
+    __slots__ = ('name', 'total', 'done', 'succeeded', 'failed', 'started', 'finished')
+
+    def __init__(self, name: str, total: int):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def rate(self) -> float:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'total': self.total,
+            'done': self.done,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'rate_per_sec': self.rate,
+            'running': self.finished is None,
+        }
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """The bot's HTTP backend: every Bot API call, bulk or not, is timed and counted by method and status."""
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+        except Exception:
+            metrics.api_requests.inc(api_method, 'network_error')
+            raise
+        finally:
+            metrics.api_request_seconds.observe(time.perf_counter() - started, api_method)
+        metrics.api_requests.inc(api_method, str(status))
+        return status, payload
+
+
+class OutboundDispatcher:
+    """
+    Every bulk Telegram call goes through call(): it waits for a token from the global
+    bucket and from the target chat's bucket, and honours RetryAfter by pausing all sends.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(DISPATCH_GLOBAL_RATE, DISPATCH_GLOBAL_BURST)
+        # chat_id -> TokenBucket, least recently used first
+        self._chats = OrderedDict()
+        self._paused_until = 0.0
+        self._jobs = {}
+        # Stats
+        self.calls = 0
+        self.retry_after_hits = 0
+        self.started = time.monotonic()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+        else:
+            # The least recently used bucket has had the longest to refill, so dropping it loses the least
+            if len(self._chats) >= DISPATCH_MAX_CHAT_BUCKETS:
+                self._chats.popitem(last=False)
+            # Negative ids are groups/channels, positive ids are private chats
+            if chat_id < 0:
+                bucket = TokenBucket(DISPATCH_GROUP_RATE_PER_MINUTE / 60, 3)
+            else:
+                bucket = TokenBucket(DISPATCH_PRIVATE_RATE, 1)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id: int):
+        now = time.monotonic()
+        pause = max(0.0, self._paused_until - now)
+        if pause:
+            await asyncio.sleep(pause)
+            now = time.monotonic()
+        # Reserve both tokens up front so concurrent senders queue behind each other fairly
+        wait = max(self._global.reserve(now), self._chat_bucket(chat_id).reserve(now))
+        if wait:
+            await asyncio.sleep(wait)
+
+    async def call(self, chat_id: int, method, *args, **kwargs):
+        """Rate-limits and sends one Bot API call for chat_id, retrying on RetryAfter."""
+        for attempt in range(DISPATCH_MAX_RETRIES + 1):
+            await self._acquire(chat_id)
+            try:
+                result = await method(*args, **kwargs)
+                self.calls += 1
+                return result
+            except telegram.error.RetryAfter as e:
+                self.retry_after_hits += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning(f"Flood control for {chat_id}: pausing sends for {e.retry_after}s (attempt {attempt + 1}).")
+                if attempt == DISPATCH_MAX_RETRIES:
+                    raise
+
+    async def run_bulk(self, name: str, items, worker, is_success=None, concurrency: int = DISPATCH_CONCURRENCY) -> list:
+        """
+        Runs worker(item) for every item with bounded concurrency and returns the results
+        in order (exceptions included, like gather(return_exceptions=True)).
+        Progress is visible through jobs() while it runs.
+        """
+        items = list(items)
+        progress = BulkProgress(name, len(items))
+        # Re-inserted so the dict stays ordered oldest first
+        self._jobs.pop(name, None)
+        self._jobs[name] = progress
+        results = [None] * len(items)
+        next_index = 0
+
+        async def run_worker():
+            nonlocal next_index
+            while next_index < len(items):
+                index = next_index
+                next_index += 1
+                try:
+                    result = await worker(items[index])
+                    ok = is_success(result) if is_success else True
+                except Exception as e:
+                    result, ok = e, False
+                results[index] = result
+                progress.done += 1
+                if ok:
+                    progress.succeeded += 1
+                else:
+                    progress.failed += 1
+
+        await asyncio.gather(*(run_worker() for _ in range(min(concurrency, len(items)))))
+        progress.finished = time.monotonic()
+        self._prune_finished_jobs()
+        logger.info(f"Bulk job '{name}' finished: {progress.succeeded}/{progress.total} ok at {progress.rate:.1f}/s.")
+        return results
+
+    def _prune_finished_jobs(self):
+        finished = [name for name, progress in self._jobs.items() if progress.finished is not None]
+        for name in finished[:max(0, len(finished) - DISPATCH_FINISHED_JOBS_KEPT)]:
+            del self._jobs[name]
+
+    def jobs(self) -> list:
+        return [progress.as_dict() for progress in self._jobs.values()]
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            'calls': self.calls,
+            'retry_after_hits': self.retry_after_hits,
+            'avg_rate_per_sec': self.calls / elapsed if elapsed > 0 else 0.0,
+            'paused_for': max(0.0, self._paused_until - time.monotonic()),
+            'chat_buckets': len(self._chats),
+        }
+
+
+dispatcher = OutboundDispatcher()
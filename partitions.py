@@ -0,0 +1,303 @@
+# partitions.py (Monthly range partitions for the messages table)
+
+import os
+import re
+import logging
+from datetime import datetime, timedelta, timezone
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# --- ⚙️ Partition Configuration ---
+# Months of partitions kept ready beyond the current one
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', '3'))
+PARTITION_MAINTENANCE_INTERVAL = int(os.environ.get('PARTITION_MAINTENANCE_INTERVAL', str(6 * 3600)))
+# Rows moved from messages_legacy per step of the online migration, and seconds between steps
+LEGACY_MOVE_BATCH = int(os.environ.get('LEGACY_MOVE_BATCH', '5000'))
+LEGACY_MOVE_INTERVAL = float(os.environ.get('LEGACY_MOVE_INTERVAL', '2'))
+
+# --- 🧹 Retention Configuration ---
+# Raw message rows older than this many UTC days are removed. Counts live on in
+# message_counts_daily and user_chat_totals, which ingestion keeps at write time.
+# 0 (the default) keeps raw rows forever; deletion is irreversible, so it is opt-in.
+RAW_RETENTION_DAYS = int(os.environ.get('RAW_RETENTION_DAYS', '0'))
+# Daily rollup rows older than this are removed too; 0 keeps them. Never below 8: the weekly scope reads 7 days
+ROLLUP_RETENTION_DAYS = int(os.environ.get('ROLLUP_RETENTION_DAYS', '0'))
+if 0 < ROLLUP_RETENTION_DAYS < 8:
+    ROLLUP_RETENTION_DAYS = 8
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', '3600'))
+RETENTION_DELETE_BATCH = int(os.environ.get('RETENTION_DELETE_BATCH', '5000'))
+# Cap per run so one job never holds a pooled connection for long; the rest waits for the next run
+RETENTION_MAX_BATCHES = int(os.environ.get('RETENTION_MAX_BATCHES', '20'))
+
+_PARTITION_NAME = re.compile(r'^messages_y(\d{4})m(\d{2})$')
+
+
+def month_start(year: int, month: int) -> datetime:
+    # Normalise overflowing months, so month_start(2025, 13) is January 2026
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+def partition_name(start: datetime) -> str:
+    return f"messages_y{start.year:04d}m{start.month:02d}"
+
+def retention_horizon(days: int, now: datetime = None) -> datetime:
+    """UTC midnight `days` days ago. Cutting at midnight keeps every retained day complete."""
+    now = now or datetime.now(timezone.utc)
+    day = (now - timedelta(days=days)).date()
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+def _raw_horizon():
+    """Cut-off for raw message rows, or None when RAW_RETENTION_DAYS keeps them forever."""
+    return retention_horizon(RAW_RETENTION_DAYS) if RAW_RETENTION_DAYS > 0 else None
+
+
+# --- DB Helpers ---
+def _ensure_partition(conn, start: datetime) -> bool:
+    """Creates the partition for the month beginning at `start`. Returns False if it already existed."""
+    name = partition_name(start)
+    end = month_start(start.year, start.month + 1)
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s);", (name,))
+        if cur.fetchone()[0]:
+            return False
+        # Rows for this month may already sit in the default partition (late backfill, missed
+        # maintenance). Attaching over them would fail, so they are moved into the new table first.
+        cur.execute(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS);")
+        cur.execute(f"""
+            WITH moved AS (
+                DELETE FROM messages_default
+                WHERE message_time >= %s AND message_time < %s
+                RETURNING id, chat_id, user_id, username, message_time
+            )
+            INSERT INTO {name} (id, chat_id, user_id, username, message_time)
+            SELECT id, chat_id, user_id, username, message_time FROM moved;
+        """, (start, end))
+        cur.execute(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s);", (start, end))
+    return True
+
+def _ensure_partitions(conn, first: datetime, last: datetime) -> int:
+    created = 0
+    current = first
+    while current <= last:
+        if _ensure_partition(conn, current):
+            created += 1
+        # Each month is its own transaction so one failure does not undo the rest
+        conn.commit()
+        current = month_start(current.year, current.month + 1)
+    return created
+
+def _legacy_range(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('messages_legacy');")
+        if not cur.fetchone()[0]:
+            return None
+        cur.execute("SELECT MIN(message_time), MAX(message_time) FROM messages_legacy;")
+        return cur.fetchone()
+
+def _move_legacy_batch(conn, batch_size, horizon=None):
+    """
+    Moves the oldest rows of messages_legacy into the partitioned table; drops it once empty.
+    Rows older than `horizon` are deleted in place rather than moved only to be expired.
+    Returns (rows taken from messages_legacy, rows moved), or None if it is already gone.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('messages_legacy');")
+        if not cur.fetchone()[0]:
+            return None
+        # Delete and insert in one statement, so a row is always visible in exactly one table
+        cur.execute("""
+            WITH taken AS (
+                DELETE FROM messages_legacy
+                WHERE id IN (SELECT id FROM messages_legacy ORDER BY id LIMIT %s)
+                RETURNING id, chat_id, user_id, username, message_time
+            ), moved AS (
+                INSERT INTO messages (id, chat_id, user_id, username, message_time)
+                SELECT id, chat_id, user_id, username, COALESCE(message_time, NOW()) FROM taken
+                WHERE %s IS NULL OR message_time IS NULL OR message_time >= %s
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM taken), (SELECT COUNT(*) FROM moved);
+        """, (batch_size, horizon, horizon))
+        taken, moved = cur.fetchone()
+        if taken == 0:
+            cur.execute("DROP TABLE messages_legacy;")
+        return taken, moved
+
+
+def _drop_expired_partitions(conn, horizon):
+    """Drops monthly partitions that end at or before `horizon`. Returns their names."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'messages'::regclass;
+        """)
+        names = [row[0] for row in cur.fetchall()]
+    dropped = []
+    for name in sorted(names):
+        match = _PARTITION_NAME.match(name)
+        if not match:
+            continue
+        end = month_start(int(match.group(1)), int(match.group(2)) + 1)
+        if end > horizon:
+            continue
+        with conn.cursor() as cur:
+            # Dropping a partition briefly locks the parent; give up rather than stall ingestion
+            cur.execute("SET LOCAL lock_timeout = '2s';")
+            cur.execute(f"DROP TABLE {name};")
+        conn.commit()
+        dropped.append(name)
+    return dropped
+
+def _delete_expired_rows(conn, horizon, batch_size, max_batches):
+    """Deletes raw rows older than `horizon` left in partially expired partitions, one batch per transaction."""
+    deleted = 0
+    for _ in range(max_batches):
+        with conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM messages
+                WHERE (id, message_time) IN (
+                    SELECT id, message_time FROM messages
+                    WHERE message_time < %s
+                    LIMIT %s
+                );
+            """, (horizon, batch_size))
+            batch = cur.rowcount
+        conn.commit()
+        deleted += batch
+        if batch < batch_size:
+            break
+    return deleted
+
+def _delete_expired_rollup(conn, before_day, batch_size, max_batches):
+    deleted = 0
+    for _ in range(max_batches):
+        with conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM message_counts_daily
+                WHERE ctid IN (SELECT ctid FROM message_counts_daily WHERE day < %s LIMIT %s);
+            """, (before_day, batch_size))
+            batch = cur.rowcount
+        conn.commit()
+        deleted += batch
+        if batch < batch_size:
+            break
+    return deleted
+
+
+class PartitionManager:
+    def __init__(self):
+        self.created = 0
+        self.legacy_moved = 0
+        self.legacy_expired = 0
+        self.legacy_prepared = False
+        self.legacy_done = False
+        self.partitions_dropped = 0
+        self.rows_expired = 0
+        self.rollup_rows_expired = 0
+
+    async def ensure_upcoming(self) -> int:
+        """Makes sure partitions exist from the current month to PARTITION_MONTHS_AHEAD months out."""
+        if not db.pool.is_open:
+            return 0
+        now = datetime.now(timezone.utc)
+        try:
+            created = await db.pool.run(
+                _ensure_partitions, month_start(now.year, now.month), month_start(now.year, now.month + PARTITION_MONTHS_AHEAD)
+            )
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
+            return 0
+        if created:
+            logger.info(f"Created {created} message partitions.")
+        self.created += created
+        return created
+
+    async def maintenance_job(self, context):
+        await self.ensure_upcoming()
+
+    async def _prepare_legacy_move(self):
+        # Partitions for every retained month still held in messages_legacy, so moved rows skip the
+        # default partition. Months past the retention horizon get none: their rows are deleted, not moved.
+        bounds = await db.pool.run(_legacy_range)
+        if bounds is not None:
+            oldest, newest = bounds
+            horizon = _raw_horizon()
+            if horizon and oldest and oldest < horizon:
+                oldest = horizon
+            if oldest and newest and oldest <= newest:
+                self.created += await db.pool.run(
+                    _ensure_partitions, month_start(oldest.year, oldest.month), month_start(newest.year, newest.month)
+                )
+        self.legacy_prepared = True
+
+    async def legacy_move_job(self, context):
+        """Repeating job: moves one batch per run and removes itself when messages_legacy is gone."""
+        if self.legacy_done or not db.pool.is_open:
+            context.job.schedule_removal()
+            return
+        try:
+            if not self.legacy_prepared:
+                await self._prepare_legacy_move()
+            result = await db.pool.run(_move_legacy_batch, LEGACY_MOVE_BATCH, _raw_horizon())
+        except Exception as e:
+            logger.error(f"Moving legacy messages failed: {e}")
+            return
+        if result is None or result[0] == 0:
+            self.legacy_done = True
+            context.job.schedule_removal()
+            if result is not None:
+                logger.info(
+                    f"Legacy messages migration finished ({self.legacy_moved} rows moved, "
+                    f"{self.legacy_expired} past retention deleted)."
+                )
+            return
+        taken, moved = result
+        self.legacy_moved += moved
+        self.legacy_expired += taken - moved
+
+    # --- Retention ---
+    async def compact(self):
+        """
+        Removes raw rows older than RAW_RETENTION_DAYS: whole partitions are dropped,
+        leftovers are deleted in bounded batches. Alltime numbers are unaffected because
+        they come from user_chat_totals, which ingestion maintains as rows are written.
+        """
+        if not db.pool.is_open:
+            return
+        try:
+            horizon = _raw_horizon()
+            if horizon:
+                dropped = await db.pool.run(_drop_expired_partitions, horizon)
+                deleted = await db.pool.run(_delete_expired_rows, horizon, RETENTION_DELETE_BATCH, RETENTION_MAX_BATCHES)
+                self.partitions_dropped += len(dropped)
+                self.rows_expired += deleted
+                if dropped or deleted:
+                    logger.info(f"Retention: dropped partitions {dropped}, deleted {deleted} raw rows before {horizon:%Y-%m-%d}.")
+            if ROLLUP_RETENTION_DAYS > 0:
+                before_day = retention_horizon(ROLLUP_RETENTION_DAYS).date()
+                deleted = await db.pool.run(_delete_expired_rollup, before_day, RETENTION_DELETE_BATCH, RETENTION_MAX_BATCHES)
+                self.rollup_rows_expired += deleted
+                if deleted:
+                    logger.info(f"Retention: deleted {deleted} daily rollup rows before {before_day}.")
+        except Exception as e:
+            logger.error(f"Retention run failed: {e}")
+
+    async def compact_job(self, context):
+        await self.compact()
+
+    def stats(self) -> dict:
+        return {
+            'created': self.created,
+            'legacy_moved': self.legacy_moved,
+            'legacy_expired': self.legacy_expired,
+            'legacy_done': self.legacy_done,
+            'partitions_dropped': self.partitions_dropped,
+            'rows_expired': self.rows_expired,
+            'rollup_rows_expired': self.rollup_rows_expired,
+        }
+
+
+manager = PartitionManager()
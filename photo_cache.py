@@ -0,0 +1,47 @@
+# photo_cache.py (TTL-bounded LRU of users' profile photo file_ids for /profile)
+
+import os
+import time
+from collections import OrderedDict
+
+# --- ⚙️ Cache Configuration ---
+PROFILE_PHOTO_CACHE_SIZE = int(os.environ.get('PROFILE_PHOTO_CACHE_SIZE', '10000'))
+PROFILE_PHOTO_TTL = int(os.environ.get('PROFILE_PHOTO_TTL', '3600'))
+
+# get() result for a user not in the cache; None is a cached "user has no photo"
+MISSING = object()
+
+
+class ProfilePhotoCache:
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        # user_id -> (file_id or None, cached_at)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, user_id, file_id):
+        self._entries[user_id] = (file_id, time.monotonic())
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def forget(self, user_id):
+        self._entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+cache = ProfilePhotoCache(PROFILE_PHOTO_CACHE_SIZE, PROFILE_PHOTO_TTL)
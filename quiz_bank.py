@@ -0,0 +1,244 @@
+# quiz_bank.py (Prefetched, de-duplicated quiz questions stored in Postgres)
+
+import os
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import random
+from urllib.parse import unquote
+
+from psycopg2.extras import execute_values
+
+import db
+import http_client
+
+logger = logging.getLogger(__name__)
+
+# --- ⚙️ Question Bank Configuration ---
+# Keep at least this many never-asked questions in the bank
+QUIZ_BANK_TARGET_SIZE = int(os.environ.get('QUIZ_BANK_TARGET_SIZE', '200'))
+QUIZ_BANK_REFILL_INTERVAL = int(os.environ.get('QUIZ_BANK_REFILL_INTERVAL', '300'))
+# Upper bound on opentdb calls per refill run; the API allows one call per 5 seconds
+QUIZ_BANK_MAX_FETCHES_PER_REFILL = int(os.environ.get('QUIZ_BANK_MAX_FETCHES_PER_REFILL', '4'))
+# Least-used questions considered when assigning one question per chat in a broadcast
+QUIZ_BROADCAST_CANDIDATES = int(os.environ.get('QUIZ_BROADCAST_CANDIDATES', '50'))
+
+OPENTDB_API_URL = "https://opentdb.com/api.php"
+OPENTDB_TOKEN_URL = "https://opentdb.com/api_token.php"
+OPENTDB_MAX_AMOUNT = 50
+OPENTDB_RATE_LIMIT_SECONDS = 5
+
+# opentdb response codes
+OPENTDB_OK = 0
+OPENTDB_TOKEN_NOT_FOUND = 3
+OPENTDB_TOKEN_EMPTY = 4
+OPENTDB_RATE_LIMITED = 5
+
+
+def question_hash(question_text: str) -> str:
+    return hashlib.sha256(question_text.strip().lower().encode('utf-8')).hexdigest()
+
+
+# --- DB Helpers ---
+def _count_unused(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM quiz_questions WHERE times_used = 0;")
+        return cur.fetchone()[0]
+
+def _insert_questions(conn, questions):
+    with conn.cursor() as cur:
+        rows = execute_values(
+            cur,
+            """
+            INSERT INTO quiz_questions (question_hash, question, correct_answer, incorrect_answers) VALUES %s
+            ON CONFLICT (question_hash) DO NOTHING
+            RETURNING id;
+            """,
+            [(question_hash(q['question']), q['question'], q['correct_answer'], json.dumps(q['incorrect_answers']))
+             for q in questions],
+            fetch=True
+        )
+        return len(rows)
+
+def _draw_for_chats(conn, chat_ids, candidates):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, question, correct_answer, incorrect_answers
+            FROM quiz_questions
+            ORDER BY times_used, id
+            LIMIT %s;
+        """, (candidates,))
+        pool = cur.fetchall()
+        if not pool:
+            return {}
+        cur.execute("""
+            SELECT chat_id, question_id FROM quiz_seen
+            WHERE chat_id = ANY(%s) AND question_id = ANY(%s);
+        """, (list(chat_ids), [row[0] for row in pool]))
+        seen = set(cur.fetchall())
+
+    assignments = {}
+    for i, chat_id in enumerate(chat_ids):
+        # Rotate the starting point so neighbouring chats get different questions
+        for offset in range(len(pool)):
+            row = pool[(i + offset) % len(pool)]
+            if (chat_id, row[0]) not in seen:
+                assignments[chat_id] = row
+                break
+        # Every candidate was already seen by this chat: repeat the least-used one rather than skip it
+        else:
+            assignments[chat_id] = pool[i % len(pool)]
+    return assignments
+
+def _mark_seen(conn, pairs):
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            "INSERT INTO quiz_seen (chat_id, question_id) VALUES %s ON CONFLICT DO NOTHING;",
+            pairs
+        )
+        usage = {}
+        for _, question_id in pairs:
+            usage[question_id] = usage.get(question_id, 0) + 1
+        execute_values(
+            cur,
+            """
+            UPDATE quiz_questions q SET times_used = q.times_used + v.uses
+            FROM (VALUES %s) AS v(id, uses)
+            WHERE q.id = v.id;
+            """,
+            sorted(usage.items())
+        )
+
+
+def build_quiz(row) -> dict:
+    """Turns a stored question into send_poll arguments with freshly shuffled options."""
+    question_id, question_text, correct_answer, incorrect_answers = row
+    all_options = list(incorrect_answers) + [correct_answer]
+    random.shuffle(all_options) # 💡 Options shuffle kiya gaya (Code Level Shuffle)
+    return {
+        'question_id': question_id,
+        'question': question_text,
+        'options': all_options,
+        'correct_option_id': all_options.index(correct_answer),
+        'explanation': f"Correct Answer: {correct_answer}",
+    }
+
+
+class QuizBank:
+    def __init__(self):
+        self._token = None
+        self._refill_lock = asyncio.Lock()
+        self.fetched = 0
+        self.inserted = 0
+        self.duplicates = 0
+
+    # --- opentdb ---
+    async def _request_token(self):
+        response = await http_client.client.get(OPENTDB_TOKEN_URL, params={"command": "request"})
+        response.raise_for_status()
+        self._token = response.json().get('token')
+
+    async def _reset_token(self):
+        response = await http_client.client.get(OPENTDB_TOKEN_URL, params={"command": "reset", "token": self._token})
+        response.raise_for_status()
+
+    async def _fetch_from_api(self, amount: int) -> list:
+        if not self._token:
+            await self._request_token()
+        params = {"amount": amount, "type": "multiple"}
+        if self._token:
+            params["token"] = self._token
+        response = await http_client.client.get(OPENTDB_API_URL, params=params)
+        response.raise_for_status()
+        data = response.json()
+        code = data.get('response_code')
+
+        if code == OPENTDB_TOKEN_NOT_FOUND:
+            # Tokens expire after 6 hours of inactivity; the next fetch asks for a new one
+            self._token = None
+            return []
+        if code == OPENTDB_TOKEN_EMPTY:
+            # The token has served every question opentdb has; start its cycle again
+            logger.info("opentdb session token exhausted, resetting it.")
+            await self._reset_token()
+            return []
+        if code != OPENTDB_OK or not data.get('results'):
+            logger.error(f"API returned error code or no results: {code}")
+            return []
+
+        questions = []
+        for question_data in data['results']:
+            # Decode question and answers
+            questions.append({
+                'question': html.unescape(unquote(question_data['question'])),
+                'correct_answer': html.unescape(unquote(question_data['correct_answer'])),
+                'incorrect_answers': [html.unescape(unquote(ans)) for ans in question_data['incorrect_answers']],
+            })
+        return questions
+
+    # --- Refill ---
+    async def refill(self) -> int:
+        """Tops the bank up to QUIZ_BANK_TARGET_SIZE unused questions. Returns how many were added."""
+        if not db.pool.is_open:
+            return 0
+        # A caller arriving mid-refill waits for it; the count below is taken after that refill
+        # so the bank is not topped up twice
+        async with self._refill_lock:
+            added = 0
+            try:
+                unused = await db.pool.run(_count_unused)
+                for attempt in range(QUIZ_BANK_MAX_FETCHES_PER_REFILL):
+                    if unused + added >= QUIZ_BANK_TARGET_SIZE:
+                        break
+                    if attempt:
+                        await asyncio.sleep(OPENTDB_RATE_LIMIT_SECONDS)
+                    questions = await self._fetch_from_api(OPENTDB_MAX_AMOUNT)
+                    if not questions:
+                        continue
+                    new_rows = await db.pool.run(_insert_questions, questions)
+                    self.fetched += len(questions)
+                    self.inserted += new_rows
+                    self.duplicates += len(questions) - new_rows
+                    added += new_rows
+            except Exception as e:
+                logger.error(f"Quiz bank refill failed: {e}")
+            if added:
+                logger.info(f"Quiz bank refilled with {added} new questions.")
+            return added
+
+    async def refill_job(self, context):
+        await self.refill()
+
+    # --- Broadcast draw ---
+    async def draw_for_chats(self, chat_ids) -> dict:
+        """
+        Assigns each chat a question it has not been asked yet, preferring the
+        least-used questions. Returns {chat_id: quiz_data}.
+        """
+        chat_ids = list(chat_ids)
+        if not db.pool.is_open or not chat_ids:
+            return {}
+        rows = await db.pool.run(_draw_for_chats, chat_ids, QUIZ_BROADCAST_CANDIDATES)
+        if not rows:
+            # Cold bank (first boot): fetch once inline instead of skipping this round
+            await self.refill()
+            rows = await db.pool.run(_draw_for_chats, chat_ids, QUIZ_BROADCAST_CANDIDATES)
+        return {chat_id: build_quiz(row) for chat_id, row in rows.items()}
+
+    async def mark_seen(self, pairs):
+        """Records (chat_id, question_id) pairs that were actually delivered."""
+        if not pairs or not db.pool.is_open:
+            return
+        try:
+            await db.pool.run(_mark_seen, list(pairs))
+        except Exception as e:
+            logger.error(f"Failed to record seen quiz questions: {e}")
+
+    def stats(self) -> dict:
+        return {'fetched': self.fetched, 'inserted': self.inserted, 'duplicates': self.duplicates}
+
+
+bank = QuizBank()
@@ -0,0 +1,385 @@
+# ranking_index.py (In-memory leaderboards: top-N and rank lookups without touching Postgres)
+
+import os
+import asyncio
+import logging
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import db
+import message_ingest
+
+logger = logging.getLogger(__name__)
+
+# --- ⚙️ Ranking Index Configuration ---
+RANKING_INDEX_ENABLED = os.environ.get('RANKING_INDEX_ENABLED', '1') == '1'
+# Days covered by the weekly scope, matching `day > today - 7` in the SQL path
+WEEK_DAYS = 7
+# Only chats with messages in the last RANKING_INDEX_ACTIVE_DAYS days get boards, at most
+# RANKING_INDEX_MAX_CHATS of them (most recently active first); the other chats are answered by SQL
+RANKING_INDEX_ACTIVE_DAYS = int(os.environ.get('RANKING_INDEX_ACTIVE_DAYS', '30'))
+RANKING_INDEX_MAX_CHATS = int(os.environ.get('RANKING_INDEX_MAX_CHATS', '5000'))
+# Target size of each sorted bucket inside a board
+_BUCKET_LOAD = 256
+
+
+class RankedBoard:
+    """
+    Per-user counts kept sorted by (-count, user_id) in buckets of about
+    _BUCKET_LOAD keys, with a Fenwick tree over bucket sizes. add(), rank()
+    and top() cost O(log n) plus one small in-bucket shift.
+    """
+
+    __slots__ = ('counts', 'total', '_buckets', '_maxes', '_tree')
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self._buckets = []
+        self._maxes = []
+        self._tree = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    @classmethod
+    def from_counts(cls, counts: dict):
+        """Builds a board from {user_id: count} with one sort instead of an insert per user."""
+        board = cls()
+        board.counts = {user_id: count for user_id, count in counts.items() if count > 0}
+        board.total = sum(board.counts.values())
+        keys = sorted((-count, user_id) for user_id, count in board.counts.items())
+        board._buckets = [keys[i:i + _BUCKET_LOAD] for i in range(0, len(keys), _BUCKET_LOAD)]
+        board._maxes = [bucket[-1] for bucket in board._buckets]
+        board._rebuild_tree()
+        return board
+
+    # --- Fenwick tree over bucket sizes ---
+    def _rebuild_tree(self):
+        tree = [len(bucket) for bucket in self._buckets]
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, i, delta):
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i |= i + 1
+
+    def _tree_prefix(self, i):
+        """Keys in buckets [0, i)."""
+        total = 0
+        i -= 1
+        while i >= 0:
+            total += self._tree[i]
+            i = (i & (i + 1)) - 1
+        return total
+
+    # --- Sorted buckets ---
+    def _insert(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._rebuild_tree()
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._buckets[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._buckets[i], key)
+        self._tree_add(i, 1)
+        bucket = self._buckets[i]
+        if len(bucket) > 2 * _BUCKET_LOAD:
+            self._buckets[i:i + 1] = [bucket[:_BUCKET_LOAD], bucket[_BUCKET_LOAD:]]
+            self._maxes[i:i + 1] = [bucket[_BUCKET_LOAD - 1], bucket[-1]]
+            self._rebuild_tree()
+
+    def _remove(self, key):
+        i = bisect_left(self._maxes, key)
+        bucket = self._buckets[i]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[i] = bucket[-1]
+            self._tree_add(i, -1)
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+            self._rebuild_tree()
+
+    def _position(self, key) -> int:
+        """Number of keys sorting before `key`."""
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return len(self.counts)
+        return self._tree_prefix(i) + bisect_left(self._buckets[i], key)
+
+    # --- Public API ---
+    def add(self, user_id: int, delta: int):
+        old = self.counts.get(user_id, 0)
+        new = old + delta
+        if old:
+            self._remove((-old, user_id))
+        if new > 0:
+            self.counts[user_id] = new
+            self._insert((-new, user_id))
+        else:
+            self.counts.pop(user_id, None)
+        self.total += delta
+
+    def rank(self, user_id: int):
+        """(rank, count) with SQL RANK() semantics (ties share a rank), or None if the user has no messages."""
+        count = self.counts.get(user_id)
+        if not count:
+            return None
+        # (-count,) sorts before every (-count, user_id): position = users with a strictly higher count
+        return self._position((-count,)) + 1, count
+
+    def top(self, n: int) -> list:
+        """[(user_id, count)] highest first."""
+        result = []
+        for bucket in self._buckets:
+            for negative_count, user_id in bucket:
+                if len(result) >= n:
+                    return result
+                result.append((user_id, -negative_count))
+        return result
+
+
+def _utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+# --- DB Helpers ---
+def _load_snapshot(conn, since_day, active_since, max_chats):
+    with conn.cursor() as cur:
+        # Most recently active first, so the cap leaves out the quietest chats
+        cur.execute("""
+            SELECT chat_id FROM message_counts_daily
+            WHERE day > %s
+            GROUP BY chat_id
+            ORDER BY MAX(day) DESC, SUM(message_count) DESC
+            LIMIT %s;
+        """, (active_since, max_chats))
+        chat_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("""
+            SELECT chat_id, user_id, day, message_count
+            FROM message_counts_daily
+            WHERE day > %s AND chat_id = ANY(%s);
+        """, (since_day, chat_ids))
+        recent = cur.fetchall()
+        cur.execute("SELECT chat_id, user_id, message_count FROM user_chat_totals WHERE chat_id = ANY(%s);", (chat_ids,))
+        totals = cur.fetchall()
+        # The global board covers every chat, so it is summed per user rather than built from `totals`
+        cur.execute("SELECT user_id, SUM(message_count) FROM user_chat_totals GROUP BY user_id;")
+        user_totals = cur.fetchall()
+    return chat_ids, recent, totals, user_totals
+
+def _load_names(conn, user_ids):
+    with conn.cursor() as cur:
+        cur.execute("SELECT user_id, display_name FROM users WHERE user_id = ANY(%s);", (list(user_ids),))
+        return dict(cur.fetchall())
+
+
+def _build_boards(snapshot, today):
+    """Turns a _load_snapshot result into (boards, days, chat ids). Pure Python; runs in a worker thread."""
+    chat_ids, recent, totals, user_totals = snapshot
+    counts = {('global', None): dict(user_totals)}
+    for chat_id, user_id, count in totals:
+        counts.setdefault(('alltime', chat_id), {})[user_id] = count
+    days = {}
+    for chat_id, user_id, day, count in recent:
+        days.setdefault(day, {}).setdefault(chat_id, Counter())[user_id] += count
+        weekly = counts.setdefault(('weekly', chat_id), {})
+        weekly[user_id] = weekly.get(user_id, 0) + count
+        if day == today:
+            daily = counts.setdefault(('daily', chat_id), {})
+            daily[user_id] = daily.get(user_id, 0) + count
+    boards = {key: RankedBoard.from_counts(board_counts) for key, board_counts in counts.items()}
+    return boards, days, set(chat_ids)
+
+
+class RankingIndex:
+    """
+    Boards for every (scope, chat): 'daily', 'weekly' and 'alltime' per chat, and
+    one 'global' board. Fed by the ingestor after each successful flush, so it
+    sees exactly what the rollup tables hold.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._listening = False
+        # Flushed batches buffered while a rebuild is in progress, replayed onto the new boards
+        self._pending = None
+        self._today = None
+        # Chats that have boards; leaderboards for any other chat go to SQL
+        self._chats = set()
+        # day -> chat_id -> Counter(user_id -> count), for the days inside the weekly window
+        self._days = {}
+        self._boards = {}
+        self.rebuild_ms = 0.0
+        self.queries = 0
+        self.name_lookups = 0
+
+    def _board(self, scope, chat_id):
+        key = (scope, chat_id)
+        board = self._boards.get(key)
+        if board is None:
+            board = self._boards[key] = RankedBoard()
+        return board
+
+    def _apply(self, chat_id, user_id, day, count, today):
+        self._board('global', None).add(user_id, count)
+        if chat_id not in self._chats:
+            return
+        self._board('alltime', chat_id).add(user_id, count)
+        if day <= today - timedelta(days=WEEK_DAYS):
+            return
+        self._days.setdefault(day, {}).setdefault(chat_id, Counter())[user_id] += count
+        self._board('weekly', chat_id).add(user_id, count)
+        if day == today:
+            self._board('daily', chat_id).add(user_id, count)
+
+    # --- Startup ---
+    async def rebuild(self):
+        """
+        Loads the boards from the rollup tables. Only the snapshot query runs between ingestion
+        flushes; the boards are built in a worker thread while flushing goes on, and the batches
+        flushed meanwhile are replayed onto them, so nothing is missed or counted twice.
+        """
+        if not RANKING_INDEX_ENABLED or not db.pool.is_open:
+            return
+        started = time.perf_counter()
+        today = _utc_today()
+        built = None
+        try:
+            snapshot = await message_ingest.ingestor.run_between_flushes(lambda: self._snapshot(today))
+            built = await asyncio.to_thread(_build_boards, snapshot, today)
+        except Exception as e:
+            logger.error(f"Ranking index rebuild failed, leaderboards stay on SQL: {e}")
+        finally:
+            pending, self._pending = self._pending, None
+        if built is None:
+            return
+        # No await from here on, so no flush can land between the swap and the replay
+        self._boards, self._days, self._chats = built
+        self._today = today
+        self.ready = True
+        for daily_counts in pending:
+            self.record(daily_counts)
+        self.rebuild_ms = (time.perf_counter() - started) * 1000
+        logger.info(
+            f"Ranking index built: {len(self._boards)} boards for {len(self._chats)} chats in {self.rebuild_ms:.0f} ms "
+            f"({len(pending)} batches replayed)."
+        )
+
+    async def _snapshot(self, today):
+        # Runs inside the ingestion barrier: every batch flushed after this point is buffered for replay
+        self._pending = []
+        if not self._listening:
+            message_ingest.ingestor.add_flush_listener(self.record)
+            self._listening = True
+        return await db.pool.run(
+            _load_snapshot, today - timedelta(days=WEEK_DAYS),
+            today - timedelta(days=RANKING_INDEX_ACTIVE_DAYS), RANKING_INDEX_MAX_CHATS
+        )
+
+    # --- Updates ---
+    def record(self, daily_counts):
+        """Flush listener: daily_counts is a Counter of (chat_id, user_id, day) -> messages."""
+        if self._pending is not None:
+            self._pending.append(daily_counts)
+            return
+        if not self.ready:
+            return
+        self.roll_over()
+        for (chat_id, user_id, day), count in daily_counts.items():
+            if day > self._today:
+                # A message stamped after midnight reached us before the scheduled rollover
+                self.roll_over(day)
+            self._apply(chat_id, user_id, day, count, self._today)
+
+    def roll_over(self, today=None):
+        """Moves the daily/weekly windows to `today` (UTC). Cheap no-op when the day has not changed."""
+        today = today or _utc_today()
+        if not self.ready or today <= self._today:
+            return
+        for key in [key for key in self._boards if key[0] == 'daily']:
+            del self._boards[key]
+        window_start = today - timedelta(days=WEEK_DAYS)
+        for day in [day for day in self._days if day <= window_start]:
+            for chat_id, users in self._days.pop(day).items():
+                board = self._board('weekly', chat_id)
+                for user_id, count in users.items():
+                    board.add(user_id, -count)
+                if not len(board):
+                    del self._boards[('weekly', chat_id)]
+        for chat_id, users in self._days.get(today, {}).items():
+            board = self._board('daily', chat_id)
+            for user_id, count in users.items():
+                board.add(user_id, count)
+        self._today = today
+
+    async def roll_over_job(self, context):
+        self.roll_over()
+
+    # --- Queries ---
+    async def leaderboard(self, scope: str, chat_id: int, user_id: int = None, limit: int = 10):
+        """
+        Returns (rows, total, user_stats) shaped like the SQL path: rows are
+        (display_name, count, user_id), user_stats is (rank, count) or None.
+        Returns None when the index is not ready.
+        """
+        if not self.ready:
+            return None
+        if scope != 'global' and chat_id not in self._chats:
+            # Inactive at startup or beyond RANKING_INDEX_MAX_CHATS
+            return None
+        self.roll_over()
+        self.queries += 1
+        board = self._boards.get((scope, None if scope == 'global' else chat_id))
+        if board is None:
+            return [], 0, None
+        top = board.top(limit)
+        names = await self._names([uid for uid, _ in top])
+        rows = [(names.get(uid), count, uid) for uid, count in top]
+        user_stats = board.rank(user_id) if user_id else None
+        return rows, board.total, user_stats
+
+    async def _names(self, user_ids):
+        names = {}
+        missing = []
+        for user_id in user_ids:
+            name = message_ingest.ingestor.known_name(user_id)
+            if name is None:
+                missing.append(user_id)
+            else:
+                names[user_id] = name
+        if missing:
+            # Only users not seen since startup; their names are cached for next time
+            self.name_lookups += 1
+            try:
+                found = await db.pool.run(_load_names, missing)
+                message_ingest.ingestor.remember_names(found)
+                names.update(found)
+            except Exception as e:
+                logger.warning(f"Failed to load display names for ranking: {e}")
+        return names
+
+    def stats(self) -> dict:
+        return {
+            'ready': self.ready,
+            'boards': len(self._boards),
+            'chats': len(self._chats),
+            'rebuild_ms': self.rebuild_ms,
+            'queries': self.queries,
+            'name_lookups': self.name_lookups,
+        }
+
+
+index = RankingIndex()
@@ -0,0 +1,104 @@
+# spam_limiter.py (Per-user sliding-window spam check with bounded memory)
+
+import os
+import sys
+import time
+from collections import OrderedDict
+
+# --- 🛡️ Spam Configuration ---
+# SPAM_MESSAGE_LIMIT messages inside SPAM_TIME_WINDOW seconds block a user for SPAM_BLOCK_DURATION seconds
+SPAM_MESSAGE_LIMIT = int(os.environ.get('SPAM_MESSAGE_LIMIT', '5'))
+SPAM_TIME_WINDOW = float(os.environ.get('SPAM_TIME_WINDOW', '2'))
+SPAM_BLOCK_DURATION = float(os.environ.get('SPAM_BLOCK_DURATION', '600'))
+# Users idle this long (and not blocked) are forgotten; never shorter than the window
+SPAM_IDLE_TTL = max(float(os.environ.get('SPAM_IDLE_TTL', '300')), SPAM_TIME_WINDOW)
+# Idle entries examined per check, so eviction cost stays flat under load
+SPAM_EVICT_PER_CHECK = 8
+
+# check() results
+ALLOWED = 0
+BLOCKED = 1      # Still serving an earlier block; ignore silently
+JUST_BLOCKED = 2 # This message tripped the limit; warn the user once
+
+
+class _UserWindow:
+    __slots__ = ('stamps', 'head', 'count', 'blocked_until', 'last_seen')
+
+    def __init__(self, size: int):
+        # Ring of the last `size` message times; `head` is the next slot to overwrite
+        self.stamps = [0.0] * size
+        self.head = 0
+        self.count = 0
+        self.blocked_until = 0.0
+        self.last_seen = 0.0
+
+
+class SpamLimiter:
+    """
+    Same rule as the old user_data list: a user is blocked when SPAM_MESSAGE_LIMIT
+    messages fall inside SPAM_TIME_WINDOW. Only the last SPAM_MESSAGE_LIMIT stamps
+    matter for that, so each user costs one fixed-size ring.
+    """
+
+    def __init__(self, limit: int, window: float, block_duration: float, idle_ttl: float):
+        self.limit = limit
+        self.window = window
+        self.block_duration = block_duration
+        self.idle_ttl = idle_ttl
+        # LRU by last message, so idle users collect at the front
+        self._users = OrderedDict()
+        self.blocks = 0
+        self.evicted = 0
+
+    def check(self, user_id: int, now: float = None) -> int:
+        now = time.time() if now is None else now
+        self._evict_idle(now)
+
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = _UserWindow(self.limit)
+        else:
+            self._users.move_to_end(user_id)
+        entry.last_seen = now
+
+        if now < entry.blocked_until:
+            return BLOCKED
+
+        entry.stamps[entry.head] = now
+        entry.head = (entry.head + 1) % self.limit
+        entry.count = min(entry.count + 1, self.limit)
+
+        # Ring is full, so `head` now points at the oldest of the last `limit` stamps
+        if entry.count == self.limit and entry.stamps[entry.head] > now - self.window:
+            entry.blocked_until = now + self.block_duration
+            entry.count = 0
+            self.blocks += 1
+            return JUST_BLOCKED
+        return ALLOWED
+
+    def _evict_idle(self, now: float):
+        for _ in range(SPAM_EVICT_PER_CHECK):
+            if not self._users:
+                return
+            user_id, entry = next(iter(self._users.items()))
+            if entry.last_seen > now - self.idle_ttl:
+                return
+            if entry.blocked_until > now:
+                # Keep the block; look at it again once it has cycled back to the front
+                self._users.move_to_end(user_id)
+                continue
+            del self._users[user_id]
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        tracked = len(self._users)
+        per_user = sys.getsizeof(_UserWindow(self.limit)) + sys.getsizeof([0.0] * self.limit) + 24 * self.limit
+        return {
+            'tracked_users': tracked,
+            'approx_bytes': sys.getsizeof(self._users) + tracked * per_user,
+            'blocks': self.blocks,
+            'evicted': self.evicted,
+        }
+
+
+limiter = SpamLimiter(SPAM_MESSAGE_LIMIT, SPAM_TIME_WINDOW, SPAM_BLOCK_DURATION, SPAM_IDLE_TTL)